@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+cache_path = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "til-results", "results.sqlite")
+
+
+def key(*parts):
+    # a hash of the JSON serializable parts; dictionaries are serialized
+    # with sorted keys, but the order of lists is kept, so callers have to
+    # sort anything which is a set
+    h = hashlib.sha256()
+    h.update(json.dumps(parts, sort_keys=True, ensure_ascii=False,
+                        separators=(",", ":")).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    # Results stored as JSON in a SQLite database, keyed by key(...). Once
+    # the stored results exceed max_bytes, the least recently used ones are
+    # evicted.
+
+    def __init__(self, path=None, max_bytes=64 << 20):
+        if path is None:
+            path = cache_path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " used REAL NOT NULL)")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, key):
+        # the stored value, or None
+        with self._db:
+            row = self._db.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE results SET used = ? WHERE key = ?",
+                (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        value = json.dumps(value, ensure_ascii=False)
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, used)"
+                " VALUES (?, ?, ?, ?)",
+                (key, value, len(key) + len(value), time.time()))
+            total, = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+            if total <= self.max_bytes:
+                return
+            # evict from the least recently used until it fits again
+            excess = total - self.max_bytes
+            for old_key, size in self._db.execute(
+                    "SELECT key, size FROM results ORDER BY used").fetchall():
+                if excess <= 0:
+                    break
+                self._db.execute("DELETE FROM results WHERE key = ?",
+                                 (old_key,))
+                excess -= size
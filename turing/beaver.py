@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+
+import copy
+
+import deciders
+import turing
+
+# steps between two samples of the cycle detector
+sample_interval = 16
+
+# kinds of results
+HALTING, CYCLE, TRANSLATED, UNDECIDED = "H", "C", "T", "U"
+
+
+def notation(table, nsymbols):
+    # the usual busy beaver notation: per state, the transition for each
+    # symbol as write, move, next state, with --- for undefined ones
+    states = []
+    for row in range(0, len(table), nsymbols):
+        entries = []
+        for transition in table[row:row+nsymbols]:
+            if transition is None:
+                entries.append("---")
+            else:
+                write, move, next_row = transition
+                entries.append("{}{}{}".format(
+                    write, "R" if move > 0 else "L",
+                    chr(ord("A") + next_row // nsymbols)))
+        states.append("".join(entries))
+    return "_".join(states)
+
+
+class Node:
+    # A machine of the tree: its (partial) transition table and the
+    # configuration in which it reached an undefined transition, or its
+    # initial configuration. The transitions are defined in the order in
+    # which the machine needs them, with states and symbols numbered in the
+    # order of their first use (tree normal form), so no two nodes are
+    # isomorphic and no node has unreachable transitions.
+
+    def __init__(self, table, tape, row, steps, detector):
+        self.table = table
+        self.tape = tape
+        self.row = row
+        self.steps = steps
+        self.detector = detector
+
+    @classmethod
+    def root(cls, nstates, nsymbols):
+        return cls((None,) * (nstates * nsymbols),
+                   turing.Tape((), 0),
+                   0,
+                   0,
+                   deciders.CycleDetector())
+
+    def _copy(self, table):
+        tape = turing.Tape((), 0)
+        tape.cells = self.tape.cells[:]
+        tape.offset = self.tape.offset
+        tape.pos = self.tape.pos
+        return Node(table, tape, self.row, self.steps,
+                    copy.copy(self.detector))
+
+    def children(self, nstates, nsymbols):
+        # the machines defining the undefined transition this one stopped
+        # at, unless it is the last undefined one, which has to halt
+        table = self.table
+        if table.count(None) < 2:
+            return []
+        tape = self.tape
+        index = tape.reserve(tape.pos)
+        key = self.row + tape.cells[index]
+        defined = [transition for transition in table
+                   if transition is not None]
+        used_states = max([0] + [next_row // nsymbols
+                                 for _, _, next_row in defined])
+        used_symbols = max([0] + [write for write, _, _ in defined])
+        # the machine mirrored left to right is the same, so the first move
+        # is to the right
+        moves = (1,) if not defined else (-1, 1)
+
+        ret = []
+        for write in range(min(used_symbols + 2, nsymbols)):
+            for move in moves:
+                for state in range(min(used_states + 2, nstates)):
+                    child = list(table)
+                    child[key] = (write, move, state * nsymbols)
+                    ret.append(self._copy(tuple(child)))
+        return ret
+
+    def run(self, max_steps):
+        # Runs the machine up to an undefined transition (HALTING), into a
+        # cycle (CYCLE or TRANSLATED) or out of steps (UNDECIDED).
+        table = self.table
+        halting = (False,) * len(table)
+        tape = self.tape
+        detector = self.detector
+        row = self.row
+        steps = self.steps
+
+        index = tape.reserve(tape.pos)
+        cells = tape.cells
+        size = len(cells)
+        try:
+            while steps < max_steps:
+                until = min(max_steps, steps + sample_interval)
+                while steps < until:
+                    transition = table[row + cells[index]]
+                    if transition is None:
+                        return HALTING
+                    cells[index], move, row = transition
+                    index += move
+                    steps += 1
+                    if not 0 <= index < size:
+                        index = tape.reserve(index - tape.offset)
+                        cells = tape.cells
+                        size = len(cells)
+
+                tape.pos = index - tape.offset
+                try:
+                    detector.observe(table, halting, tape, row, steps)
+                except turing.NonTerminating:
+                    return TRANSLATED if detector.shift else CYCLE
+                index = tape.reserve(tape.pos)
+                cells = tape.cells
+                size = len(cells)
+            return UNDECIDED
+        finally:
+            tape.pos = index - tape.offset
+            self.row = row
+            self.steps = steps
+
+    def ones(self):
+        # after the halting transition, which writes a 1 (in tree normal
+        # form) where the head is, so a blank there gains one
+        tape = self.tape
+        index = tape.reserve(tape.pos)
+        ones = len(tape.cells) - tape.cells.count(0)
+        if not tape.cells[index]:
+            ones += 1
+        return ones
+
+
+def _visit(node, nsymbols, max_steps, counts, lines):
+    # runs the node and records its result; returns whether it halted
+    kind = node.run(max_steps)
+    counts[kind] += 1
+    if kind == HALTING:
+        # the halting step is the one on the undefined transition, which
+        # counts for the ones as well
+        lines.append("{} {} {} {}".format(
+            kind, node.steps + 1, node.ones(),
+            notation(node.table, nsymbols)))
+    elif kind == UNDECIDED:
+        lines.append("{} {} {}".format(
+            kind, node.steps, notation(node.table, nsymbols)))
+    return kind == HALTING
+
+
+def new_counts():
+    return dict.fromkeys((HALTING, CYCLE, TRANSLATED, UNDECIDED), 0)
+
+
+def explore(nodes, nstates, nsymbols, max_steps):
+    # Explores the trees below the nodes depth first. Returns the counts of
+    # each kind of result and the lines of the results file for the halting
+    # and undecided machines: kind, steps, (ones,) machine.
+    counts = new_counts()
+    lines = []
+    stack = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
+        if _visit(node, nsymbols, max_steps, counts, lines):
+            stack.extend(reversed(node.children(nstates, nsymbols)))
+    return counts, lines
+
+
+def seed(nstates, nsymbols, max_steps, tasks):
+    # Expands the tree breadth first until there are at least `tasks`
+    # nodes to explore. Returns these and the results of the expanded
+    # nodes, like explore. The expansion is deterministic, so the tasks are
+    # the same for each call.
+    counts = new_counts()
+    lines = []
+    frontier = [Node.root(nstates, nsymbols)]
+    while frontier and len(frontier) < tasks:
+        expanded = []
+        for node in frontier:
+            if _visit(node, nsymbols, max_steps, counts, lines):
+                expanded += node.children(nstates, nsymbols)
+        frontier = expanded
+    return frontier, counts, lines
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+import argparse
+import collections
+import logging
+import time
+import tracemalloc
+
+from turing import Tape
+
+
+class DictTape(collections.defaultdict):
+    # the previous, defaultdict based tape, kept for comparison
+    logger = logging.getLogger(__qualname__)
+
+    def __init__(self, data, blank):
+        super().__init__(lambda: blank)
+
+        if not data:
+            data = [blank]
+
+        for i in range(len(data)):
+            self[i] = data[i]
+
+        self.pos = 0
+        self.blank = blank
+
+    def move(self, movement):
+        self.pos += movement
+        self.logger.debug("head moved by {}".format(movement))
+
+    def read(self):
+        self.logger.debug("read {}".format(self[self.pos]))
+        return self[self.pos]
+
+    def write(self, char):
+        self[self.pos] = char
+        self.logger.debug("wrote {}".format(char))
+
+
+def sweep(tape, cells):
+    # walk right over half the cells, then left over all of them, ending as
+    # far left of cell 0, writing an "a" to every cell; growing the tape to
+    # the left is the expensive direction
+    for movement, count in ((1, cells // 2), (-1, cells)):
+        for i in range(count):
+            tape.write("a")
+            tape.move(movement)
+
+
+def measure(tape_type, cells, blank):
+    data = ["a"] * cells
+
+    # tracemalloc slows down allocations considerably, so time and memory
+    # are measured in separate runs
+    start = time.perf_counter()
+    tape = tape_type(data, blank)
+    sweep(tape, 2*cells)
+    elapsed = time.perf_counter() - start
+    if any(tape[pos] != "a" for pos in range(1 - cells, cells)):
+        raise AssertionError("{} lost writes".format(tape_type.__name__))
+
+    tracemalloc.start()
+    tape = tape_type(data, blank)
+    sweep(tape, 2*cells)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare memory use and throughput of the array backed"
+        " tape against the previous defaultdict based one.")
+    parser.add_argument(
+        "cells",
+        nargs="*",
+        type=int,
+        default=[10**4, 10**5],
+        help="Input lengths to measure")
+    args = parser.parse_args()
+
+    print("{:>10} {:>8} {:>12} {:>14} {:>12}".format(
+        "cells", "tape", "peak bytes", "bytes/cell", "steps/s"))
+    for cells in args.cells:
+        for name, tape_type in (("dict", DictTape), ("array", Tape)):
+            elapsed, peak = measure(tape_type, cells, "b̸")
+            print("{:>10} {:>8} {:>12} {:>14.1f} {:>12.0f}".format(
+                cells, name, peak, peak / (2*cells), 3*cells / elapsed))
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+import concurrent.futures
+import os
+
+import beaver
+
+# The results file starts with a header line. Then follow blocks of results
+# lines (see beaver.explore), each closed by a marker line: "S counts..." for
+# the results of seeding the tasks, and "T task counts..." for those of a
+# task, counts being the number of halting, cycling, translated cycling and
+# undecided machines. Only complete blocks count when resuming.
+HEADER = "# busy beaver {} states {} symbols {} steps {} tasks\n"
+
+
+def _init_worker(nstates, nsymbols, max_steps, tasks):
+    # the seeding is deterministic, so each worker repeats it instead of
+    # receiving the nodes
+    global _state
+    nodes, _, _ = beaver.seed(nstates, nsymbols, max_steps, tasks)
+    _state = nodes, nstates, nsymbols, max_steps
+
+
+def _explore_task(task):
+    nodes, nstates, nsymbols, max_steps = _state
+    counts, lines = beaver.explore([nodes[task]], nstates, nsymbols,
+                                   max_steps)
+    return task, counts, lines
+
+
+def _block(lines, marker, counts):
+    return "".join(line + "\n" for line in lines) + "{} {}\n".format(
+        marker, " ".join(str(counts[kind]) for kind in counts))
+
+
+def read_progress(path, header):
+    # Whether the seed block is complete and the set of complete tasks.
+    # Cuts off an incomplete last block.
+    seeded = False
+    done = set()
+    with open(path, "r+") as f:
+        if f.readline() != header:
+            raise ValueError(
+                "{} was written with other parameters".format(path))
+        end = f.tell()
+        for line in iter(f.readline, ""):
+            if not line.endswith("\n"):
+                break
+            kind = line.split(None, 1)[0]
+            if kind == "S":
+                seeded = True
+            elif kind == "T":
+                done.add(int(line.split()[1]))
+            else:
+                continue
+            end = f.tell()
+        f.truncate(end)
+    return seeded, done
+
+
+def summarize(path):
+    totals = beaver.new_counts()
+    steps_champion = ones_champion = None
+    with open(path) as f:
+        f.readline()
+        for line in f:
+            fields = line.split()
+            if fields[0] in ("S", "T"):
+                for kind, count in zip(list(totals), fields[-4:]):
+                    totals[kind] += int(count)
+            elif fields[0] == beaver.HALTING:
+                steps, ones = int(fields[1]), int(fields[2])
+                if steps_champion is None or steps > steps_champion[0]:
+                    steps_champion = steps, ones, fields[3]
+                if ones_champion is None or ones > ones_champion[1]:
+                    ones_champion = steps, ones, fields[3]
+    return totals, steps_champion, ones_champion
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description="Enumerate the machines with the given number of states"
+        " and symbols in tree normal form, starting on a blank tape, and"
+        " sort them into halting, cycling and undecided ones.")
+    parser.add_argument(
+        "--max-steps",
+        type=int,
+        default=10000,
+        help="Number of steps after which a machine is undecided"
+        " (default: %(default)s)")
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument(
+        "--tasks",
+        type=int,
+        default=None,
+        help="Number of subtrees to distribute to the workers"
+        " (default: 64 per job)")
+    parser.add_argument(
+        "-o", "--output",
+        default=None,
+        help="Results file (default: bb-STATESxSYMBOLS.txt)")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Continue with the tasks missing from the results file")
+    parser.add_argument(
+        "states",
+        type=int)
+    parser.add_argument(
+        "symbols",
+        type=int)
+    args = parser.parse_args()
+
+    if args.states < 1 or args.symbols < 2:
+        print("need at least one state and two symbols", file=sys.stderr)
+        sys.exit(1)
+    jobs = args.jobs or os.cpu_count() or 1
+    tasks = args.tasks or 64 * jobs
+    output = args.output or "bb-{}x{}.txt".format(args.states, args.symbols)
+    header = HEADER.format(args.states, args.symbols, args.max_steps, tasks)
+
+    seeded, done = False, set()
+    if args.resume and os.path.exists(output):
+        try:
+            seeded, done = read_progress(output, header)
+        except ValueError as exc:
+            print(exc, file=sys.stderr)
+            sys.exit(1)
+    else:
+        with open(output, "w") as f:
+            f.write(header)
+
+    nodes, counts, lines = beaver.seed(args.states, args.symbols,
+                                       args.max_steps, tasks)
+    with open(output, "a") as f:
+        if not seeded:
+            f.write(_block(lines, "S", counts))
+            f.flush()
+
+        todo = [task for task in range(len(nodes)) if task not in done]
+        if jobs <= 1:
+            _init_worker(args.states, args.symbols, args.max_steps, tasks)
+            results = map(_explore_task, todo)
+        else:
+            pool = concurrent.futures.ProcessPoolExecutor(
+                jobs,
+                initializer=_init_worker,
+                initargs=(args.states, args.symbols, args.max_steps, tasks))
+            results = (future.result() for future in
+                       concurrent.futures.as_completed(
+                           pool.submit(_explore_task, task)
+                           for task in todo))
+        for task, counts, lines in results:
+            # whole blocks at once, so a killed run leaves at most one
+            # incomplete block
+            f.write(_block(lines, "T {}".format(task), counts))
+            f.flush()
+        if jobs > 1:
+            pool.shutdown()
+
+    totals, steps_champion, ones_champion = summarize(output)
+    print("halting {H}, cycling {C}, translated cycling {T},"
+          " undecided {U}".format(**totals))
+    if steps_champion is not None:
+        print("most steps: {} ({} ones) {}".format(*steps_champion))
+        print("most ones: {} ({} steps) {}".format(
+            ones_champion[1], ones_champion[0], ones_champion[2]))
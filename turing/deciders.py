@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+
+import turing
+
+
+def find_cycle(table, halting, cells, index, row, period):
+    # Runs `period` steps from the configuration (row, index, cells) on a
+    # copy of the tape and checks whether the machine provably repeats what
+    # it did forever. Returns the shift of the head per period (0 for a
+    # plain cycle) if so, None otherwise.
+    #
+    # Let [lo, hi] be the cells visited during the period. If afterwards
+    # the machine is in the same state and [lo, hi] shifted by the head's
+    # displacement reads as [lo, hi] did before, the next period does the
+    # same, shifted. For a non-zero shift this needs the tape beyond the
+    # visited cells in the direction of the shift to be blank.
+
+    # the head stays within `period` cells of where it started and so does
+    # the shifted window
+    pad = array_of_blanks(cells, 2*period)
+    before = pad + cells + pad
+    index += 2*period
+    start = index
+    start_row = row
+
+    work = before[:]
+    lo = hi = index
+    for _ in range(period):
+        if halting[row]:
+            return None
+        transition = table[row + work[index]]
+        if transition is None:
+            return None
+        work[index], move, row = transition
+        index += move
+        if index < lo:
+            lo = index
+        elif index > hi:
+            hi = index
+
+    if row != start_row:
+        return None
+
+    shift = index - start
+    if work[lo+shift:hi+shift+1] != before[lo:hi+1]:
+        return None
+    if shift > 0 and any_symbol(before[hi+1:]):
+        return None
+    if shift < 0 and any_symbol(before[:lo]):
+        return None
+    return shift
+
+
+def array_of_blanks(cells, count):
+    return cells[:0] + type(cells)(cells.typecode, [0]) * count
+
+
+def any_symbol(cells):
+    return cells.count(0) != len(cells)
+
+
+class CycleDetector:
+    # Brent's algorithm on sampled configurations: every sample is compared
+    # against a saved one, which is replaced by the current sample whenever
+    # the number of samples since saving it reaches a power of two. Samples
+    # are compared by the state and a window of cells around the head, so
+    # the same key is also found for a machine drifting into blank tape.
+    # Matches are only candidates and get verified by find_cycle.
+
+    def __init__(self, window=16):
+        self.window = window
+        self._saved = None
+        self._saved_steps = 0
+        self._power = 1
+        self._age = 0
+        # of the cycle found
+        self.period = None
+        self.shift = None
+
+    def _key(self, tape, row):
+        tape.reserve(tape.pos - self.window)
+        tape.reserve(tape.pos + self.window)
+        index = tape.pos + tape.offset
+        return (row,
+                tape.cells[index-self.window:index+self.window+1].tobytes())
+
+    def sample(self, machine):
+        self.observe(machine._table, machine._halting, machine.tape,
+                     machine._state_codes[machine.state] * machine._nsymbols,
+                     machine.steps)
+
+    def observe(self, table, halting, tape, row, steps):
+        # sample for a machine given by its compiled table, in the state of
+        # the given row
+        key = self._key(tape, row)
+
+        if key == self._saved:
+            period = steps - self._saved_steps
+            shift = find_cycle(table, halting, tape.cells,
+                               tape.pos + tape.offset, row, period)
+            if shift is not None:
+                self.period = period
+                self.shift = shift
+                if shift:
+                    raise turing.NonTerminating(
+                        "machine moves {} cells every {} steps forever".format(
+                            shift, period))
+                raise turing.NonTerminating(
+                    "machine repeats itself every {} steps".format(period))
+
+        self._age += 1
+        if self._saved is None or self._age >= self._power:
+            self._saved = key
+            self._saved_steps = steps
+            self._power *= 2
+            self._age = 0
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+
+import hashlib
+import importlib.util
+import marshal
+import os
+
+cache_dir = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "til-turing", "jit")
+
+_loaded = {}
+
+
+def _grow_check(move, indent):
+    if move > 0:
+        check = "index >= size"
+    elif move < 0:
+        check = "index < 0"
+    else:
+        return []
+    return [
+        indent + "if {}:".format(check),
+        indent + "    index = tape.reserve(index - tape.offset)",
+        indent + "    cells = tape.cells",
+        indent + "    size = len(cells)",
+    ]
+
+
+def generate(machine):
+    # Emits the source of a function run(tape, state, index) specialised to
+    # the machine. Every state gets its own block inside a dispatch loop;
+    # transitions looping on a state stay inside that state's block.
+    # The function returns (state, index, steps, halted).
+    names = machine._state_names
+    nsymbols = machine._nsymbols
+    table = machine._table
+    halting = machine._halting
+    symbols = machine.tape.symbols
+
+    lines = [
+        "def run(tape, state, index):",
+        "    cells = tape.cells",
+        "    size = len(cells)",
+        "    steps = 0",
+        "    while True:",
+    ]
+
+    keyword = "if"
+    for state, name in enumerate(names):
+        row = state * nsymbols
+        lines.append("        {} state == {}:  # {!r}".format(
+            keyword, state, name))
+        keyword = "elif"
+
+        if halting[row]:
+            lines.append("            return state, index, steps, True")
+            continue
+
+        lines.append("            while True:")
+        lines.append("                symbol = cells[index]")
+        for symbol in range(nsymbols):
+            transition = table[row + symbol]
+            if transition is None:
+                continue
+            write, move, next_row = transition
+            lines.append("                if symbol == {}:  # {!r}".format(
+                symbol, symbols[symbol]))
+            body = "                    "
+            if write != symbol:
+                lines.append(body + "cells[index] = {}".format(write))
+            if move > 0:
+                lines.append(body + "index += {}".format(move))
+            elif move < 0:
+                lines.append(body + "index -= {}".format(-move))
+            lines.append(body + "steps += 1")
+            lines.extend(_grow_check(move, body))
+            if next_row == row:
+                lines.append(body + "continue")
+            else:
+                lines.append(body + "state = {}".format(next_row // nsymbols))
+                lines.append(body + "break")
+        lines.append("                return state, index, steps, False")
+
+    lines.append("")
+    return "\n".join(lines)
+
+
+def load(machine, cache_dir=cache_dir):
+    # Returns the compiled run function for the machine. Code objects are
+    # cached by the hash of their source, in memory and (unless cache_dir
+    # is None) as marshalled files on disk.
+    source = generate(machine)
+    key = hashlib.sha256(
+        importlib.util.MAGIC_NUMBER + source.encode("utf-8")).hexdigest()
+
+    try:
+        return _loaded[key]
+    except KeyError:
+        pass
+
+    code = None
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, key + ".bin")
+        try:
+            with open(path, "rb") as f:
+                code = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            code = None
+
+    if code is None:
+        code = compile(source, "<turing machine {}>".format(key[:12]), "exec")
+        if path is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp = "{}.{}.tmp".format(path, os.getpid())
+                with open(tmp, "wb") as f:
+                    marshal.dump(code, f)
+                os.replace(tmp, path)
+            except OSError:
+                pass
+
+    namespace = {}
+    exec(code, namespace)
+    function = namespace["run"]
+    _loaded[key] = function
+    return function
+
+
+def run_jit(machine, cache_dir=cache_dir):
+    if len(machine.tape.symbols) != machine._nsymbols:
+        machine.compile()
+
+    function = load(machine, cache_dir=cache_dir)
+    tape = machine.tape
+    state, index, steps, halted = function(
+        tape,
+        machine._state_codes[machine.state],
+        tape.reserve(tape.pos))
+
+    tape.pos = index - tape.offset
+    machine.steps += steps
+    machine.state = machine._state_names[state]
+
+    if not halted:
+        raise ValueError("no transition found from current state")
@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import turing
+
+
+class LockstepMachine:
+    # Runs one machine on many tapes at once. The tapes are the rows of one
+    # symbol matrix, and every step is a handful of vectorized gathers and
+    # scatters over the lanes which are still running. Lanes drop out once
+    # they halt, get stuck or exhaust max_steps.
+
+    def __init__(self, tapes, transitions, initial_state, accepting_states,
+                 blank="b̸", outputs=1):
+        if numpy is None:
+            raise ImportError("the lockstep engine needs numpy")
+
+        tapes = [list(tape) for tape in tapes]
+
+        # the interning and transition table of a regular machine are reused
+        machine = turing.TuringMachine([], transitions, initial_state,
+                                       accepting_states, blank=blank,
+                                       outputs=outputs)
+        for tape in tapes:
+            for char in tape:
+                machine.tape.intern(char)
+        machine.compile()
+        self.machine = machine
+        self.outputs = outputs
+
+        nsymbols = machine._nsymbols
+        write = numpy.zeros(len(machine._table), dtype=numpy.int64)
+        move = numpy.zeros(len(machine._table), dtype=numpy.int64)
+        # next state, -1 where there is no transition
+        next_state = numpy.full(len(machine._table), -1, dtype=numpy.int64)
+        for i, transition in enumerate(machine._table):
+            if transition is not None:
+                write[i], move[i], next_row = transition
+                next_state[i] = next_row // nsymbols
+        self._write = write
+        self._move = move
+        self._next = next_state
+        self._halting = numpy.array(machine._halting[::nsymbols],
+                                    dtype=bool)
+
+        if nsymbols <= 0x100:
+            dtype = numpy.uint8
+        else:
+            dtype = numpy.uint32
+        codes = machine.tape.codes
+        width = max([len(tape) for tape in tapes] + [1])
+        self.cells = numpy.zeros((len(tapes), 2*width), dtype=dtype)
+        for lane, tape in enumerate(tapes):
+            self.cells[lane, width:width+len(tape)] = [codes[char]
+                                                       for char in tape]
+        self.heads = numpy.full(len(tapes), width, dtype=numpy.int64)
+        self.states = numpy.full(len(tapes),
+                                 machine._state_codes[initial_state],
+                                 dtype=numpy.int64)
+        self.steps = numpy.zeros(len(tapes), dtype=numpy.int64)
+        # 0: running, 1: halted, 2: stuck, 3: out of steps
+        self.status = numpy.zeros(len(tapes), dtype=numpy.int8)
+        self.status[self._halting[self.states]] = 1
+
+    RUNNING, HALTED, STUCK, EXHAUSTED = range(4)
+
+    def _grow(self, left, right):
+        lanes, width = self.cells.shape
+        extra_left = width if left else 0
+        extra_right = width if right else 0
+        cells = numpy.zeros((lanes, width + extra_left + extra_right),
+                            dtype=self.cells.dtype)
+        cells[:, extra_left:extra_left+width] = self.cells
+        self.cells = cells
+        self.heads += extra_left
+
+    def run(self, max_steps=None):
+        nsymbols = self.machine._nsymbols
+        lanes = numpy.flatnonzero(self.status == self.RUNNING)
+        step = 0
+        while len(lanes):
+            if max_steps is not None and step >= max_steps:
+                self.status[lanes] = self.EXHAUSTED
+                break
+
+            heads = self.heads[lanes]
+            index = self.states[lanes] * nsymbols + self.cells[lanes, heads]
+            next_state = self._next[index]
+
+            stuck = next_state < 0
+            if stuck.any():
+                self.status[lanes[stuck]] = self.STUCK
+                keep = ~stuck
+                lanes = lanes[keep]
+                heads = heads[keep]
+                index = index[keep]
+                next_state = next_state[keep]
+
+            self.cells[lanes, heads] = self._write[index]
+            heads += self._move[index]
+            self.heads[lanes] = heads
+            self.states[lanes] = next_state
+            self.steps[lanes] += 1
+            step += 1
+
+            # lanes which just halted count too, as their output is read
+            # from their head on
+            if len(heads):
+                left = heads.min() < 0
+                right = heads.max() >= self.cells.shape[1]
+                if left or right:
+                    self._grow(left, right)
+
+            halted = self._halting[next_state]
+            if halted.any():
+                self.status[lanes[halted]] = self.HALTED
+                lanes = lanes[~halted]
+
+    def state(self, lane):
+        return self.machine._state_names[self.states[lane]]
+
+    def output(self, lane):
+        # the same as TuringMachine.output for the given lane
+        symbols = self.machine.tape.symbols
+        row = self.cells[lane, self.heads[lane]:]
+        blanks = numpy.flatnonzero(row == 0)
+        ret = []
+        start = 0
+        for end in blanks[:self.outputs]:
+            ret.append("".join(symbols[code] for code in row[start:end]))
+            start = end + 1
+        while len(ret) < self.outputs:
+            ret.append("".join(symbols[code] for code in row[start:]))
+            start = len(row)
+        return ret
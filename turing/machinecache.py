@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+
+import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+cache_dir = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "til-turing", "machines")
+
+# File layout: magic, header length, JSON header, padding up to a multiple
+# of 4 bytes, then the transitions as native int32 quintuples of (state,
+# read, write, move, next state), states and symbols being indices into the
+# header's lists. On machines with k tapes, read, write and move are k
+# integers each. The header also records the byte order, so the transition
+# array can be used from the memory map directly.
+MAGIC = b"TILTM\x00\x00\x03"
+_prefix = struct.Struct("<8sI")
+
+
+def key(f, blank):
+    # hashes the (binary) file object without holding all of it in memory
+    h = hashlib.sha256()
+    h.update(blank.encode("utf-8"))
+    h.update(b"\x00")
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def _path(key):
+    return os.path.join(cache_dir, key + ".tm")
+
+
+def store(key, machine_def):
+    (machine_type,
+     input_signature,
+     output_signature,
+     transitions,
+     initial_state,
+     final_states,
+     tapes) = machine_def
+
+    states = {}
+    symbols = {}
+
+    def intern(table, value):
+        return table.setdefault(value, len(table))
+
+    cells = array.array("i")
+    for state, rchar, wchar, move, new_state in transitions:
+        cells.append(intern(states, state))
+        if tapes > 1:
+            cells.extend(intern(symbols, char) for char in rchar)
+            cells.extend(intern(symbols, char) for char in wchar)
+            cells.extend(move)
+        else:
+            cells.extend((intern(symbols, rchar),
+                          intern(symbols, wchar),
+                          move))
+        cells.append(intern(states, new_state))
+
+    header = json.dumps({
+        "byteorder": sys.byteorder,
+        "type": list(machine_type),
+        "input": [list(item) for item in input_signature],
+        "output": [list(item) for item in output_signature],
+        "start": initial_state,
+        "final": list(final_states),
+        "tapes": tapes,
+        "states": list(states),
+        "symbols": list(symbols),
+    }).encode("utf-8")
+    header += b" " * (-(_prefix.size + len(header)) % 4)
+
+    path = _path(key)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(_prefix.pack(MAGIC, len(header)))
+            f.write(header)
+            cells.tofile(f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def load(key):
+    # returns the machine definition as stored, or None if it is not cached
+    # or the file is damaged, so that the caller parses and stores it again
+    try:
+        f = open(_path(key), "rb")
+    except OSError:
+        return None
+
+    with f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+    with mapped:
+        try:
+            return _decode(mapped)
+        except (ValueError, KeyError, IndexError, TypeError):
+            # truncated, or not written by store
+            return None
+
+
+def _decode(mapped):
+    if len(mapped) < _prefix.size:
+        return None
+    magic, header_size = _prefix.unpack_from(mapped)
+    if magic != MAGIC:
+        return None
+    start = _prefix.size + header_size
+    header = json.loads(mapped[_prefix.size:start].decode("utf-8"))
+    if header["byteorder"] != sys.byteorder:
+        return None
+
+    states = header["states"]
+    symbols = header["symbols"]
+    tapes = header["tapes"]
+    with memoryview(mapped) as whole, whole[start:] as raw, \
+            raw.cast("i") as view:
+        if tapes > 1:
+            stride = 2 + 3*tapes
+            transitions = [
+                (states[view[i]],
+                 tuple(symbols[code] for code in view[i+1:i+1+tapes]),
+                 tuple(symbols[code]
+                       for code in view[i+1+tapes:i+1+2*tapes]),
+                 tuple(view[i+1+2*tapes:i+1+3*tapes]),
+                 states[view[i+stride-1]])
+                for i in range(0, len(view), stride)]
+        else:
+            transitions = [
+                (states[view[i]], symbols[view[i+1]], symbols[view[i+2]],
+                 view[i+3], states[view[i+4]])
+                for i in range(0, len(view), 5)]
+
+    return (tuple(header["type"]),
+            [tuple(item) for item in header["input"]],
+            [tuple(item) for item in header["output"]],
+            transitions,
+            header["start"],
+            header["final"],
+            tapes)
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+
+import array
+import functools
+import sys
+import time
+
+import turing
+
+
+class MacroMachine:
+    # Simulates a TuringMachine on blocks of block_size cells. The effect of
+    # entering a block in a given state at a given cell (running until the
+    # head leaves the block, the machine halts or gets stuck) is computed
+    # once and kept in a bounded LRU cache, so the machine advances by a
+    # whole block per macro step whenever the cache hits.
+
+    def __init__(self, machine, block_size=8, cache_size=2**16):
+        if block_size < 1:
+            raise ValueError("block size must be positive")
+
+        self.machine = machine
+        self.block_size = block_size
+        self.macro_steps = 0
+        self._simulate = functools.lru_cache(maxsize=cache_size)(
+            self._simulate_block)
+
+    @property
+    def cache_hits(self):
+        return self._simulate.cache_info().hits
+
+    @property
+    def cache_misses(self):
+        return self._simulate.cache_info().misses
+
+    @property
+    def hit_rate(self):
+        info = self._simulate.cache_info()
+        lookups = info.hits + info.misses
+        if not lookups:
+            return 0.0
+        return info.hits / lookups
+
+    def _simulate_block(self, row, block, index):
+        # returns the new block, the state row, the head index (-1 or
+        # block_size if the head left the block) and the number of steps
+        machine = self.machine
+        table = machine._table
+        halting = machine._halting
+        size = self.block_size
+        limit = self._limit
+
+        cells = list(block)
+        steps = 0
+        while 0 <= index < size and not halting[row]:
+            transition = table[row + cells[index]]
+            if transition is None:
+                break
+            cells[index], move, row = transition
+            index += move
+            steps += 1
+            if steps > limit:
+                raise turing.NonTerminating(
+                    "machine loops forever within a block")
+
+        return type(block)(cells), row, index, steps
+
+    def _load(self, tape):
+        size = self.block_size
+        extent = tape.extent()
+        blocks = {}
+        if extent is None:
+            return blocks
+
+        first = extent[0] // size
+        last = extent[1] // size
+        tape.reserve(first*size)
+        tape.reserve((last+1)*size - 1)
+        for number in range(first, last+1):
+            start = number*size + tape.offset
+            blocks[number] = self._pack(tape.cells[start:start+size])
+        return blocks
+
+    def _store(self, tape, blocks, pos):
+        size = self.block_size
+        blank = self._pack([0] * size)
+        first = min(min(blocks, default=pos // size), pos // size)
+        last = max(max(blocks, default=pos // size), pos // size)
+
+        cells = array.array(tape.cells.typecode)
+        for number in range(first, last+1):
+            cells.extend(blocks.get(number, blank))
+
+        tape.cells = cells
+        tape.offset = -first * size
+        tape.pos = pos
+
+    def run(self, max_steps=None, timeout=None, detect_cycles=False):
+        # The timeout and the cycle detector are looked at between macro
+        # steps, about every check_interval steps. A block which would take
+        # the machine past max_steps is left to the compiled engine, so the
+        # machine stops on the same step as there.
+        machine = self.machine
+        if len(machine.tape.symbols) != machine._nsymbols:
+            machine.compile()
+
+        if machine._nsymbols <= 0x100:
+            self._pack = bytes
+        else:
+            self._pack = tuple
+
+        size = self.block_size
+        # a block has only this many configurations, running longer means
+        # the machine will never leave it
+        self._limit = len(machine._table) * size * machine._nsymbols ** size
+        blank = self._pack([0] * size)
+        halting = machine._halting
+        nsymbols = machine._nsymbols
+        simulate = self._simulate
+
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        if detect_cycles:
+            import deciders
+            detector = deciders.CycleDetector()
+        budget = sys.maxsize
+        if max_steps is not None:
+            budget = max_steps - machine.steps
+        check = machine.check_interval
+
+        tape = machine.tape
+        blocks = self._load(tape)
+        number, index = divmod(tape.pos, size)
+        row = machine._state_codes[machine.state] * nsymbols
+        steps = 0
+        macro_steps = 0
+        exhausted = False
+        try:
+            while not halting[row]:
+                if steps >= check:
+                    check = steps + machine.check_interval
+                    if timeout is not None and time.monotonic() >= deadline:
+                        raise turing.BudgetExhausted(
+                            "time budget of {}s exhausted".format(timeout))
+                    if detect_cycles:
+                        self._store(tape, blocks, number*size + index)
+                        detector.observe(machine._table, halting, tape, row,
+                                         machine.steps + steps)
+
+                if steps >= budget:
+                    exhausted = True
+                    break
+                block, new_row, new_index, taken = simulate(
+                    row, blocks.get(number, blank), index)
+                if steps + taken > budget:
+                    exhausted = True
+                    break
+                row = new_row
+                index = new_index
+                if block == blank:
+                    blocks.pop(number, None)
+                else:
+                    blocks[number] = block
+                steps += taken
+                macro_steps += 1
+                if index < 0:
+                    number -= 1
+                    index = size - 1
+                elif index >= size:
+                    number += 1
+                    index = 0
+                elif not halting[row]:
+                    break
+        finally:
+            self._store(tape, blocks, number*size + index)
+            self.macro_steps += macro_steps
+            machine.steps += steps
+            machine.state = machine._state_names[row // nsymbols]
+
+        if exhausted:
+            if not machine._run_compiled(max_steps):
+                raise turing.BudgetExhausted(
+                    "step budget of {} exhausted".format(max_steps))
+            return
+        if not halting[row]:
+            raise ValueError("no transition found from current state")
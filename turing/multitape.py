@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+
+import sys
+import time
+
+import turing
+
+
+class MultiTapeMachine:
+    # A machine with k tapes and one head per tape. Transitions read and
+    # write k-tuples of symbols and move every head on its own.
+    #
+    # All tapes share one interning (blank=0), so the symbols read by the k
+    # heads combine into a single integer, the digits of which are the
+    # codes in base nsymbols. The transition table maps state * nsymbols**k
+    # plus that integer to the codes to write, the moves and the next state.
+
+    check_interval = 2**14
+
+    def __init__(self, tapes, transitions, initial_state, accepting_states,
+                 blank="b̸", outputs=None):
+        tapes = [list(tape) for tape in tapes]
+        self.blank = blank
+        self.accepting_states = set(accepting_states)
+        if outputs is None:
+            outputs = [1] + [0] * (len(tapes) - 1)
+        self.outputs = outputs
+
+        alphabet = set()
+        for _, rchars, wchars, _, _ in transitions:
+            alphabet.update(rchars)
+            alphabet.update(wchars)
+            if len(rchars) != len(tapes) or len(wchars) != len(tapes):
+                raise ValueError("transition for {} tapes on a machine with"
+                                 " {} tapes".format(len(rchars), len(tapes)))
+        for tape in tapes:
+            alphabet.update(tape)
+        alphabet.discard(blank)
+        alphabet = sorted(alphabet, key=str)
+        self.tapes = [turing.Tape(tape, blank, alphabet) for tape in tapes]
+
+        self._state_names = []
+        self._state_codes = {}
+
+        def intern(state):
+            try:
+                return self._state_codes[state]
+            except KeyError:
+                self._state_codes[state] = len(self._state_names)
+                self._state_names.append(state)
+                return self._state_codes[state]
+
+        intern(initial_state)
+        codes = self.tapes[0].codes
+        nsymbols = len(codes)
+        self._weights = [nsymbols**i for i in range(len(tapes))]
+        self._width = nsymbols**len(tapes)
+        table = {}
+        for state, rchars, wchars, moves, new_state in transitions:
+            key = intern(state) * self._width + sum(
+                codes[char] * weight
+                for char, weight in zip(rchars, self._weights))
+            table[key] = (tuple(codes[char] for char in wchars),
+                          tuple(moves),
+                          intern(new_state))
+        for state in accepting_states:
+            intern(state)
+        self._table = table
+        self._halting = [state in self.accepting_states
+                         for state in self._state_names]
+
+        self.state = initial_state
+        self.steps = 0
+
+    def run(self, max_steps=None, timeout=None):
+        if max_steps is None and timeout is None:
+            self._run_compiled()
+            return
+
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while True:
+            limit = self.steps + self.check_interval
+            if max_steps is not None:
+                limit = min(limit, max_steps)
+            if self._run_compiled(limit):
+                return
+
+            if max_steps is not None and self.steps >= max_steps:
+                raise turing.BudgetExhausted(
+                    "step budget of {} exhausted".format(max_steps))
+            if timeout is not None and time.monotonic() >= deadline:
+                raise turing.BudgetExhausted(
+                    "time budget of {}s exhausted".format(timeout))
+
+    def _run_compiled(self, limit=None):
+        # the same contract as TuringMachine._run_compiled
+        tapes = self.tapes
+        table = self._table
+        halting = self._halting
+        width = self._width
+        weights = self._weights
+        heads = range(len(tapes))
+
+        state = self._state_codes[self.state]
+        index = [tape.reserve(tape.pos) for tape in tapes]
+        cells = [tape.cells for tape in tapes]
+        steps = 0
+        if limit is None:
+            budget = sys.maxsize
+        else:
+            budget = limit - self.steps
+        transition = ()
+        try:
+            while steps < budget and not halting[state]:
+                key = state * width
+                for i in heads:
+                    key += cells[i][index[i]] * weights[i]
+                transition = table.get(key)
+                if transition is None:
+                    break
+                writes, moves, state = transition
+                for i in heads:
+                    cells[i][index[i]] = writes[i]
+                    index[i] += moves[i]
+                    if not 0 <= index[i] < len(cells[i]):
+                        tape = tapes[i]
+                        index[i] = tape.reserve(index[i] - tape.offset)
+                        cells[i] = tape.cells
+                steps += 1
+        finally:
+            for tape, i in zip(tapes, index):
+                tape.pos = i - tape.offset
+            self.steps += steps
+            self.state = self._state_names[state]
+
+        if transition is None:
+            raise ValueError("no transition found from current state")
+        return halting[state]
+
+    def output(self):
+        # a list of the values on each tape, read from the head onwards
+        return [tape.read_vars(count) if count else []
+                for tape, count in zip(self.tapes, self.outputs)]
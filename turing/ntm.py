@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+
+import array
+import concurrent.futures
+
+import turing
+
+# bits reserved for the left half of the tape in a packed configuration
+_LEFT_BITS = 40
+
+
+class NondeterministicTuringMachine:
+    # Decides acceptance by a breadth-first search over configurations.
+    #
+    # The tape is a zipper: the symbol under the head and two hash-consed
+    # cons lists for the cells left and right of it (nearest cell first).
+    # A cons cell is identified by an integer id, 0 being the infinite blank
+    # list, and moving the head only creates a single cell, so every tape is
+    # shared with its parent's. A configuration is then just four integers
+    # (packed into one), which makes deduplication a set lookup. As the
+    # head position is implicit, configurations which only differ by a
+    # translation are merged as well.
+
+    def __init__(self, tape, transitions, initial_state, accepting_states,
+                 blank="b̸"):
+        self.blank = blank
+        self.symbols = [blank]
+        self.codes = {blank: 0}
+        self.state_names = []
+        self.state_codes = {}
+
+        self._intern_state(initial_state)
+        for state in accepting_states:
+            self._intern_state(state)
+
+        table = {}
+        for state, rchar, wchar, move_head, new_state in transitions:
+            key = (self._intern_state(state), self._intern_symbol(rchar))
+            table.setdefault(key, []).append((
+                self._intern_symbol(wchar),
+                move_head,
+                self._intern_state(new_state)))
+        tape = [self._intern_symbol(char) for char in tape]
+
+        nsymbols = len(self.symbols)
+        self._table = [()] * (len(self.state_names) * nsymbols)
+        for (state, symbol), successors in table.items():
+            self._table[state * nsymbols + symbol] = tuple(successors)
+        self._accepting = [False] * len(self.state_names)
+        for state in accepting_states:
+            self._accepting[self.state_codes[state]] = True
+
+        self._reset_tapes()
+        right = 0
+        for symbol in reversed(tape[1:]):
+            right = self._push(symbol, right)
+        self.initial = self._pack(self.state_codes[initial_state],
+                                  tape[0] if tape else 0,
+                                  0,
+                                  right)
+        self.steps = 0
+        self.configurations = 0
+
+    def _intern_state(self, state):
+        try:
+            return self.state_codes[state]
+        except KeyError:
+            self.state_codes[state] = len(self.state_names)
+            self.state_names.append(state)
+            return self.state_codes[state]
+
+    def _intern_symbol(self, char):
+        try:
+            return self.codes[char]
+        except KeyError:
+            self.codes[char] = len(self.symbols)
+            self.symbols.append(char)
+            return self.codes[char]
+
+    def _reset_tapes(self):
+        self._cons = {}
+        self._heads = array.array("L", [0])
+        self._tails = array.array("Q", [0])
+
+    def _push(self, symbol, tail):
+        if not symbol and not tail:
+            return 0
+        key = tail * len(self.symbols) + symbol
+        try:
+            return self._cons[key]
+        except KeyError:
+            cell = len(self._heads)
+            self._cons[key] = cell
+            self._heads.append(symbol)
+            self._tails.append(tail)
+            return cell
+
+    def _pack(self, state, head, left, right):
+        if left >> _LEFT_BITS:
+            raise turing.BudgetExhausted("too many distinct tapes")
+        packed = (right << _LEFT_BITS) | left
+        return (packed * len(self.symbols) + head) * len(self.state_names) \
+            + state
+
+    def _unpack(self, config):
+        config, state = divmod(config, len(self.state_names))
+        packed, head = divmod(config, len(self.symbols))
+        return (state, head, packed & ((1 << _LEFT_BITS) - 1),
+                packed >> _LEFT_BITS)
+
+    def successors(self, config):
+        state, head, left, right = self._unpack(config)
+        heads = self._heads
+        tails = self._tails
+        for write, move, new_state in self._table[
+                state * len(self.symbols) + head]:
+            if move > 0:
+                yield self._pack(new_state, heads[right],
+                                 self._push(write, left), tails[right])
+            elif move < 0:
+                yield self._pack(new_state, heads[left],
+                                 tails[left], self._push(write, right))
+            else:
+                yield self._pack(new_state, write, left, right)
+
+    def accepting(self, config):
+        return self._accepting[config % len(self.state_names)]
+
+    def encode(self, config):
+        # a process independent form of a configuration: state, head symbol
+        # and the symbols to the left and right, nearest first
+        state, head, left, right = self._unpack(config)
+        sides = []
+        for cell in (left, right):
+            symbols = []
+            while cell:
+                symbols.append(self._heads[cell])
+                cell = self._tails[cell]
+            sides.append(tuple(symbols))
+        return (state, head) + tuple(sides)
+
+    def decode(self, encoded):
+        state, head, left_symbols, right_symbols = encoded
+        sides = []
+        for symbols in (left_symbols, right_symbols):
+            cell = 0
+            for symbol in reversed(symbols):
+                cell = self._push(symbol, cell)
+            sides.append(cell)
+        return self._pack(state, head, *sides)
+
+    def _expand(self, frontier, seen, max_configurations):
+        # returns the next frontier, or None if an accepting configuration
+        # was found
+        successors = []
+        for config in frontier:
+            for successor in self.successors(config):
+                if successor in seen:
+                    continue
+                if self.accepting(successor):
+                    return None
+                seen.add(successor)
+                successors.append(successor)
+                if max_configurations is not None and \
+                        len(seen) > max_configurations:
+                    self.configurations = len(seen)
+                    raise turing.BudgetExhausted(
+                        "configuration budget of {} exhausted".format(
+                            max_configurations))
+        return successors
+
+    def run(self, max_steps=None, max_configurations=None, jobs=1,
+            levels=8, chunk_size=256):
+        # Returns whether the machine accepts. Rejects once every branch is
+        # stuck or no new configurations are reachable. max_steps bounds the
+        # search depth, max_configurations the number of configurations
+        # kept for deduplication.
+        if self.accepting(self.initial):
+            return True
+
+        seen = {self.initial}
+        frontier = [self.initial]
+        if jobs > 1:
+            return self._run_parallel(frontier, seen, max_steps,
+                                      max_configurations, jobs, levels,
+                                      chunk_size)
+
+        while frontier:
+            if max_steps is not None and self.steps >= max_steps:
+                raise turing.BudgetExhausted(
+                    "step budget of {} exhausted".format(max_steps))
+            frontier = self._expand(frontier, seen, max_configurations)
+            self.steps += 1
+            self.configurations = len(seen)
+            if frontier is None:
+                return True
+        return False
+
+    def _run_parallel(self, frontier, seen, max_steps, max_configurations,
+                      jobs, levels, chunk_size):
+        # Workers get chunks of the frontier in encoded form and search
+        # `levels` levels deep on their own tapes. Only the configurations
+        # they reach at the end are deduplicated here. Each worker may keep
+        # as many new configurations as are left of max_configurations.
+        setup = (self.symbols, self.state_names, self._table,
+                 self._accepting)
+        with concurrent.futures.ProcessPoolExecutor(
+                jobs,
+                initializer=_init_worker,
+                initargs=setup) as pool:
+            while frontier:
+                if max_steps is not None and self.steps >= max_steps:
+                    raise turing.BudgetExhausted(
+                        "step budget of {} exhausted".format(max_steps))
+                depth = levels
+                if max_steps is not None:
+                    depth = min(depth, max_steps - self.steps)
+
+                chunks = [
+                    [self.encode(config)
+                     for config in frontier[i:i+chunk_size]]
+                    for i in range(0, len(frontier), chunk_size)]
+                remaining = None
+                if max_configurations is not None:
+                    remaining = max_configurations - len(seen)
+                next_frontier = []
+                for accepted, reached in pool.map(
+                        _expand_chunk, chunks, [depth] * len(chunks),
+                        [remaining] * len(chunks)):
+                    if accepted:
+                        return True
+                    if reached is None:
+                        # a worker ran out of configurations
+                        self.configurations = len(seen)
+                        raise turing.BudgetExhausted(
+                            "configuration budget of {} exhausted".format(
+                                max_configurations))
+                    for encoded in reached:
+                        config = self.decode(encoded)
+                        if config not in seen:
+                            seen.add(config)
+                            next_frontier.append(config)
+                    if max_configurations is not None and \
+                            len(seen) > max_configurations:
+                        raise turing.BudgetExhausted(
+                            "configuration budget of {} exhausted".format(
+                                max_configurations))
+
+                frontier = next_frontier
+                self.steps += depth
+                self.configurations = len(seen)
+        return False
+
+
+_worker = None
+
+
+def _init_worker(symbols, state_names, table, accepting):
+    global _worker
+    worker = NondeterministicTuringMachine.__new__(
+        NondeterministicTuringMachine)
+    worker.symbols = symbols
+    worker.state_names = state_names
+    worker._table = table
+    worker._accepting = accepting
+    _worker = worker
+
+
+def _expand_chunk(chunk, depth, remaining):
+    # (accepted, configurations reached), with None for the latter if more
+    # than `remaining` new configurations were needed
+    worker = _worker
+    worker._reset_tapes()
+    frontier = [worker.decode(encoded) for encoded in chunk]
+    seen = set(frontier)
+    if remaining is not None:
+        remaining += len(seen)
+    for _ in range(depth):
+        try:
+            frontier = worker._expand(frontier, seen, remaining)
+        except turing.BudgetExhausted:
+            return False, None
+        if frontier is None:
+            return True, []
+    return False, [worker.encode(config) for config in frontier]
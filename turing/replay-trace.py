@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+import argparse
+
+import tracefile
+
+
+def show(tape, window):
+    # the tape like str(tape), or only `window` cells to each side of the
+    # head
+    if window is None:
+        return str(tape)
+    return "".join(
+        "[{}]".format(tape[pos]) if pos == tape.pos else tape[pos]
+        for pos in range(tape.pos - window, tape.pos + window + 1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Inspect a trace recorded with run-turing.py --trace."
+        " Without steps, print the length of the trace.")
+    parser.add_argument(
+        "-w", "--window",
+        type=int,
+        default=None,
+        metavar="CELLS",
+        help="Only print this many cells to each side of the head")
+    parser.add_argument(
+        "-r", "--records",
+        action="store_true",
+        default=False,
+        help="Also print the state, written symbol and move of each of the"
+        " given steps")
+    parser.add_argument(
+        "trace",
+        help="Trace file")
+    parser.add_argument(
+        "steps",
+        nargs="*",
+        type=int,
+        help="Steps after which to print the configuration; negative steps"
+        " count from the end of the trace")
+    args = parser.parse_args()
+
+    with tracefile.TraceReader(args.trace) as trace:
+        if not args.steps:
+            print("steps {} to {}".format(trace.start, len(trace)))
+
+        for step in args.steps:
+            if step < 0:
+                step += len(trace) + 1
+            state, tape = trace.configuration(step)
+            if args.records and step > trace.start:
+                print("step {}: wrote {}, moved {}".format(
+                    step, *trace.record(step)[1:]))
+            print("step {}: state {} {}".format(step, state,
+                                                show(tape, args.window)))
@@ -1,20 +1,36 @@
 #!/usr/bin/python3
-import ast
+import collections
+import concurrent.futures
+import csv
+import itertools
+import json
 import logging
+import os
 import re
-
-typeline = re.compile(r"^type\s*:\s*(.*?)$", re.I)
-inputline = re.compile(r"^input\s*:\s*(([^,]+)(,\s*([^,]+))*)$", re.I)
-outputline = re.compile(r"^output\s*:\s*(([^,]+)(,\s*([^,]+))*)$", re.I)
-finalline = re.compile(r"^final\s*:\s*(([^,]+)(,\s*([^,]+)\s*)*)$", re.I)
-startline = re.compile(r"^start\s*:\s*(.*)\s*$", re.I)
-
-class TransformNamesToStr(ast.NodeTransformer):
-    def visit_Name(self, node):
-        return ast.Str(
-            node.id,
-            lineno=node.lineno,
-            col_offset=node.col_offset)
+import sys
+
+import turing
+
+# the result cache is shared with the LOOP interpreter, one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import resultcache
+
+directiveline = re.compile(
+    r"(type|input|output|final|start|tapes)\s*:\s*(.*)$", re.I)
+# a single element of a transition: a bare word or a quoted string
+_element = (r"[^\s,()'\"]+"
+            r"|'(?:[^'\\]|\\.)*'"
+            r'|"(?:[^"\\]|\\.)*"')
+# fast path for the common, flat five element transition
+transitionline = re.compile(
+    r"\(\s*({0})\s*,\s*({0})\s*,\s*({0})\s*,\s*({0})\s*,\s*({0})"
+    r"\s*,?\s*\)\s*,?$".format(_element))
+token = re.compile(r"\s*(?:([(),])|({}))".format(_element))
+escape = re.compile(r"\\(.)", re.S)
+
+EXIT_BUDGET = 3
+EXIT_LOOPING = 4
 
 class Natural:
     @classmethod
@@ -29,6 +45,16 @@ class Natural:
     def from_turing_output(cls, value):
         return value
 
+    @classmethod
+    def to_turing_runs(cls, value):
+        raise ValueError("naturals need an encoding on the tape, e.g. unary"
+                         " or binary")
+
+    @classmethod
+    def from_turing_runs(cls, runs):
+        raise ValueError("naturals need an encoding on the tape, e.g. unary"
+                         " or binary")
+
     def __str__(self):
         return "natural"
 
@@ -56,12 +82,48 @@ class Unary:
     def from_turing_output(self, value):
         return len(value)
 
+    # the tape side of the codecs works on (symbol, count) runs, so unary
+    # values are never spelled out
+
+    def to_turing_runs(self, value):
+        return [(self.char, value)] if value else []
+
+    def from_turing_runs(self, runs):
+        return sum(count for _, count in runs)
+
     def __str__(self):
         return "unary char {}".format(self.char)
 
+class Binary:
+    # most significant digit first, zero being 0
+    def process_args(self, args):
+        return args
+
+    def to_turing_input(self, value):
+        return "{:b}".format(value)
+
+    def from_turing_output(self, value):
+        if not value or value.strip("01"):
+            raise ValueError("invalid binary output: {!r}".format(value))
+        return int(value, 2)
+
+    def to_turing_runs(self, value):
+        return [(char, len(list(group)))
+                for char, group in itertools.groupby(
+                    self.to_turing_input(value))]
+
+    def from_turing_runs(self, runs):
+        return self.from_turing_output("".join(char * count
+                                               for char, count in runs))
+
+    def __str__(self):
+        return "binary"
+
 class TypeChain:
     def __init__(self, *types):
         self.types = list(types)
+        # index of the tape the value is on
+        self.tape = 0
 
     def to_turing_input(self, value):
         for type_ in self.types:
@@ -73,6 +135,17 @@ class TypeChain:
             value = type_.from_turing_output(value)
         return value
 
+    def to_turing_runs(self, value):
+        for type_ in self.types[:-1]:
+            value = type_.to_turing_input(value)
+        return self.types[-1].to_turing_runs(value)
+
+    def from_turing_runs(self, runs):
+        value = self.types[-1].from_turing_runs(runs)
+        for type_ in reversed(self.types[:-1]):
+            value = type_.from_turing_output(value)
+        return value
+
     def __str__(self):
         return "{}".format(
             " ".join(self.types[1:] + self.types[0]))
@@ -82,7 +155,8 @@ types = {
 }
 
 transforms = {
-    "unary": Unary
+    "unary": Unary,
+    "binary": Binary,
 }
 
 def parse_type(typetuple):
@@ -93,6 +167,18 @@ def parse_type(typetuple):
     if not typetuple:
         raise ValueError("Types must not be empty")
 
+    tape = 0
+    if typetuple[-1].startswith("@"):
+        try:
+            tape = int(typetuple[-1][1:]) - 1
+        except ValueError:
+            tape = -1
+        if tape < 0:
+            raise ValueError("Invalid tape: {}".format(typetuple[-1]))
+        typetuple = typetuple[:-1]
+        if not typetuple:
+            raise ValueError("Types must not be empty")
+
     typename = typetuple[-1]
     try:
         chain = [types[typename.lower()]()]
@@ -115,166 +201,688 @@ def parse_type(typetuple):
                 err))
         chain.append(qualifier)
 
-    return TypeChain(*chain)
+    chain = TypeChain(*chain)
+    chain.tape = tape
+    return chain
 
 
-def parse_machine(lines, blank):
-    transitions = set()
+class ParseError(ValueError):
+    def __init__(self, lineno, column, message):
+        super().__init__("line {}, column {}: {}".format(
+            lineno, column, message))
+        self.lineno = lineno
+        self.column = column
+
+
+def unquote(element):
+    if element[0] in "'\"":
+        return escape.sub(r"\1", element[1:-1])
+    return element
+
+
+_comma = object()
+
+
+class _ElementError(Exception):
+    # an invalid element of a transition, by its position among the elements
+    # of the line, before its column is known
+    def __init__(self, index, message):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+
+
+def tokenize_tuple(line, lineno, column, columns=None):
+    # Parses a (possibly nested) tuple of elements, followed by an optional
+    # comma. This is the slow path, which is also used to locate errors.
+    # The columns of the elements are appended to `columns` if given.
+    pos = 0
+    stack = [[]]
+    done = False
+    while True:
+        m = token.match(line, pos)
+        if m is None:
+            if line[pos:].strip():
+                raise ParseError(
+                    lineno,
+                    column + pos + len(line[pos:]) - len(line[pos:].lstrip()),
+                    "unexpected character")
+            break
+
+        where = column + m.start(m.lastindex)
+        punctuation, element = m.groups()
+        pos = m.end()
+        if done:
+            if punctuation != "," or line[pos:].strip():
+                raise ParseError(lineno, where,
+                                 "unexpected input after transition")
+            break
+        if punctuation == "(":
+            if stack[-1] and stack[-1][-1] is not _comma:
+                raise ParseError(lineno, where, "missing comma")
+            stack.append([])
+        elif punctuation == ")":
+            if len(stack) == 1:
+                raise ParseError(lineno, where, "unbalanced parenthesis")
+            items = stack.pop()
+            value = tuple(item for item in items if item is not _comma)
+            if stack[-1] and stack[-1][-1] is not _comma:
+                raise ParseError(lineno, where, "missing comma")
+            stack[-1].append(value)
+            if len(stack) == 1:
+                done = True
+        elif punctuation == ",":
+            if not stack[-1] or stack[-1][-1] is _comma:
+                raise ParseError(lineno, where, "unexpected comma")
+            stack[-1].append(_comma)
+        else:
+            if len(stack) == 1:
+                raise ParseError(lineno, where,
+                                 "transitions must be tuples")
+            if stack[-1] and stack[-1][-1] is not _comma:
+                raise ParseError(lineno, where, "missing comma")
+            stack[-1].append(unquote(element))
+            if columns is not None:
+                columns.append(where)
+
+    if not done:
+        raise ParseError(lineno, column + len(line), "unterminated tuple")
+    return stack[0][0]
+
+
+machine_types = {
+    ("dtm", "function"),
+    ("ntm", "acceptor"),
+}
+
+
+def parse_machine_raw(lines, blank):
+    # Like parse_machine, but leaves the signatures as tuples of words.
+    # `lines` can be any iterable of lines, including a file object; it is
+    # consumed lazily.
+    transitions = {}
 
     machine_type = None
     input_signature = None
     output_signature = None
     final_states = None
     initial_state = None
+    tapes = None
+    # number of symbols per transition element, and where that was set
+    width = None
 
-    def set_type(m):
+    def set_type(value):
         nonlocal machine_type
 
         if machine_type is not None:
             raise ValueError("Multiple type directives")
 
-        machine_type = tuple(m.group(1).lower().split())
+        machine_type = tuple(value.lower().split())
 
-    def set_input_signature(m):
+    def parse_list(value):
+        items = [item.strip() for item in value.split(",")]
+        if not all(items):
+            raise ValueError("Empty list item")
+        return items
+
+    def set_input_signature(value):
         nonlocal input_signature
 
         if input_signature is not None:
             raise ValueError("Multiple input signatures")
 
-        input_signature = [
-            tuple(item.strip().split(" "))
-            for item in m.group(1).split(",")
-        ]
+        input_signature = [tuple(item.split(" "))
+                           for item in parse_list(value)]
 
-    def set_output_signature(m):
+    def set_output_signature(value):
         nonlocal output_signature
 
         if output_signature is not None:
             raise ValueError("Multiple output signatures")
 
-        output_signature = [
-            tuple(item.strip().split(" "))
-            for item in m.group(1).split(",")
-        ]
+        output_signature = [tuple(item.split(" "))
+                            for item in parse_list(value)]
 
-    def set_final_states(m):
+    def set_final_states(value):
         nonlocal final_states
 
         if final_states is not None:
             raise ValueError("Multiple final state directives")
 
-        final_states = m.group(1).split(",")
+        final_states = parse_list(value)
 
-    def set_initial_state(m):
+    def set_initial_state(value):
         nonlocal initial_state
 
         if initial_state is not None:
             raise ValueError("Multiple start state directives")
 
-        initial_state = m.group(1)
+        initial_state = value
+
+    def set_tapes(value):
+        nonlocal tapes
 
-    def get_transition(line):
-        line = line.rstrip(",")
+        if tapes is not None:
+            raise ValueError("Multiple tapes directives")
 
         try:
-            transition = compile(
-                line,
-                "",
-                "eval",
-                ast.PyCF_ONLY_AST).body
-        except SyntaxError:
-            raise ValueError("Not a valid transition line")
-
-        if not isinstance(transition, ast.Tuple):
-            raise ValueError("Top level transition element must be a tuple")
-
-        transition = TransformNamesToStr().visit(transition)
-        transition = ast.Expression(
-            transition,
-            lineno=0,
-            col_offset=0)
-        transition_code = compile(transition, "", "eval")
-        transition = eval(transition_code, {}, {})
-
-        return transition
-
-    linetypes = {
-        typeline: set_type,
-        inputline: set_input_signature,
-        outputline: set_output_signature,
-        finalline: set_final_states,
-        startline: set_initial_state,
+            tapes = int(value)
+        except ValueError:
+            tapes = 0
+        if tapes < 1:
+            raise ValueError("Invalid number of tapes: {}".format(value))
+
+    directives = {
+        "type": set_type,
+        "input": set_input_signature,
+        "output": set_output_signature,
+        "final": set_final_states,
+        "start": set_initial_state,
+        "tapes": set_tapes,
     }
 
-    for line in lines:
+    direction_map = {
+        "n": 0,
+        "l": -1,
+        "r": 1
+    }
+
+    def map_char(char, index):
+        if char == "blank":
+            return blank
+        elif len(char) != 1:
+            raise _ElementError(index, "Characters must be of length 1")
+        return char
+
+    def map_direction(direction, index):
+        try:
+            return direction_map[direction]
+        except KeyError:
+            raise _ElementError(
+                index, "Unknown direction: {}".format(direction)) from None
+
+    for lineno, line in enumerate(lines, 1):
         hashpos = line.find("#")
         if hashpos >= 0:
             line = line[:hashpos]
-        line = line.strip()
-        if not line:
+        stripped = line.strip()
+        if not stripped:
             continue
+        column = len(line) - len(line.lstrip()) + 1
 
-        for linetype, processor in linetypes.items():
-            m = linetype.match(line)
+        if stripped[0] != "(":
+            m = directiveline.match(stripped)
             if m is None:
-                continue
-
-            processor(m)
-            break
-        else:
+                raise ParseError(lineno, column,
+                                 "neither a transition nor a directive")
             try:
-                transition = get_transition(line)
+                directives[m.group(1).lower()](m.group(2).strip())
             except ValueError as err:
-                raise ValueError("Unparsable line: `{}` ({}, and not a valid directive)".format(line, err))
-
-            transitions.add(transition)
-
-    input_signature = list(map(parse_type, input_signature))
-    output_signature = list(map(parse_type, output_signature))
+                raise ParseError(lineno, column + m.start(2), err) from None
+            continue
 
-    if machine_type != ("dtm", "function"):
-        raise ValueError("unsupported machine type: {}".format(
-            " ".join(machine_type)))
+        m = transitionline.match(stripped)
+        if m is not None and "'" not in stripped and '"' not in stripped:
+            transition = m.groups()
+        else:
+            transition = tokenize_tuple(stripped, lineno, column)
+            if len(transition) != 5 or not (
+                    isinstance(transition[0], str) and
+                    isinstance(transition[4], str)):
+                raise ParseError(lineno, column,
+                                 "transitions are tuples of five elements")
+        qp, r, w, direction, qn = transition
+
+        # on multi-tape machines, the symbols and directions are tuples with
+        # one element per tape
+        if isinstance(r, tuple):
+            size = len(r)
+        else:
+            size = None
+        if width is None:
+            width = (size, lineno)
+        elif width[0] != size:
+            raise ParseError(lineno, column,
+                             "transition for another number of tapes than"
+                             " the one on line {}".format(width[1]))
+        try:
+            if size is None:
+                transition = (qp,
+                              map_char(r, 1),
+                              map_char(w, 2),
+                              map_direction(direction, 3),
+                              qn)
+            else:
+                if not all(isinstance(item, tuple) and len(item) == size and
+                           all(isinstance(element, str) for element in item)
+                           for item in (r, w, direction)):
+                    raise ParseError(lineno, column,
+                                     "symbols and directions must be tuples"
+                                     " of the same length")
+                transition = (
+                    qp,
+                    tuple(map_char(char, 1 + i) for i, char in enumerate(r)),
+                    tuple(map_char(char, 1 + size + i)
+                          for i, char in enumerate(w)),
+                    tuple(map_direction(item, 1 + 2*size + i)
+                          for i, item in enumerate(direction)),
+                    qn)
+        except _ElementError as err:
+            # the fast path does not keep positions, so the line is
+            # tokenized again to find the element
+            columns = []
+            tokenize_tuple(stripped, lineno, column, columns)
+            raise ParseError(lineno, columns[err.index], err.message) \
+                from None
+        transitions[transition] = None
 
     if machine_type is None:
         raise ValueError("Missing type directive")
     if input_signature is None:
         raise ValueError("Missing input directive")
-    if output_signature is None:
-        raise ValueError("Missing output directive")
     if initial_state is None:
         raise ValueError("Missing start directive")
     if final_states is None:
         raise ValueError("Missing final directive")
+    if tapes is None:
+        tapes = 1
+    # single tape transitions are flat
+    if width is not None and width[0] != (tapes if tapes > 1 else None):
+        raise ValueError("transition on line {} is not for {} tape(s)".format(
+            width[1], tapes))
+    if tapes > 1 and machine_type[0] != "dtm":
+        raise ValueError("{} machines have a single tape".format(
+            " ".join(machine_type)))
 
-    direction_map = {
-        "n": 0,
-        "l": -1,
-        "r": 1
-    }
+    if machine_type not in machine_types:
+        raise ValueError("unsupported machine type: {}".format(
+            " ".join(machine_type)))
+    if output_signature is None:
+        if machine_type[1] != "acceptor":
+            raise ValueError("Missing output directive")
+        output_signature = []
+
+    return (machine_type, input_signature, output_signature,
+            list(transitions), initial_state, final_states, tapes)
+
+
+def parse_signatures(machine_def):
+    (machine_type,
+     input_signature,
+     output_signature,
+     transitions,
+     initial_state,
+     final_states,
+     tapes) = machine_def
+
+    input_signature = list(map(parse_type, input_signature))
+    output_signature = list(map(parse_type, output_signature))
+    for item in input_signature + output_signature:
+        if item.tape >= tapes:
+            raise ValueError("Machine has no tape @{}".format(item.tape + 1))
+
+    return (machine_type,
+            input_signature,
+            output_signature,
+            transitions,
+            initial_state,
+            final_states,
+            tapes)
+
+
+def parse_machine(lines, blank):
+    return parse_signatures(parse_machine_raw(lines, blank))
+
+
+def load_machine(path, blank, use_cache=True):
+    # parses the machine file, going through the machine cache unless
+    # use_cache is false
+    if use_cache:
+        import machinecache
+        with open(path, "rb") as f:
+            key = machinecache.key(f, blank)
+        machine_def = machinecache.load(key)
+        if machine_def is not None:
+            return parse_signatures(machine_def)
+
+    with open(path, "r", encoding="utf-8") as f:
+        machine_def = parse_machine_raw(f, blank)
+    if use_cache:
+        machinecache.store(key, machine_def)
+    return parse_signatures(machine_def)
+
+def initial_tape_runs(machine_def, blank, values):
+    # the contents of each tape as (symbol, count) runs
+    input_signature = machine_def[1]
+    if len(input_signature) != len(values):
+        raise ValueError("Turing machine expects {} input(s), but {}"
+                         " given".format(len(input_signature),
+                                         len(values)))
+
+    # the inputs of each tape follow each other, separated by blanks
+    tapes = [[] for _ in range(machine_def[6])]
+    for arg, inputtype in zip(values, input_signature):
+        tape = tapes[inputtype.tape]
+        tape += inputtype.to_turing_runs(arg)
+        tape.append((blank, 1))
+    return tapes
+
+
+def initial_tapes(machine_def, blank, values):
+    return [[char for char, count in runs for _ in range(count)]
+            for runs in initial_tape_runs(machine_def, blank, values)]
+
+
+def initial_tape(machine_def, blank, values):
+    return initial_tapes(machine_def, blank, values)[0]
+
+
+def build_machine(machine_def, blank, values, tracer=None):
+    (_,
+     _,
+     output_signature,
+     transitions,
+     initial_state,
+     final_states,
+     tapes) = machine_def
+
+    if tapes > 1:
+        import multitape
+        outputs = [0] * tapes
+        for outputtype in output_signature:
+            outputs[outputtype.tape] += 1
+        return multitape.MultiTapeMachine(
+            initial_tapes(machine_def, blank, values),
+            transitions,
+            initial_state,
+            final_states,
+            blank=blank,
+            outputs=outputs)
+
+    return turing.TuringMachine(
+        None,
+        transitions,
+        initial_state,
+        final_states,
+        blank=blank,
+        outputs=len(output_signature),
+        tracer=tracer,
+        tape_runs=initial_tape_runs(machine_def, blank, values)[0])
+
+
+def build_ntm(machine_def, blank, values):
+    import ntm
+    (_,
+     _,
+     _,
+     transitions,
+     initial_state,
+     final_states,
+     _) = machine_def
+
+    return ntm.NondeterministicTuringMachine(
+        initial_tape(machine_def, blank, values),
+        transitions,
+        initial_state,
+        final_states,
+        blank=blank)
 
-    def map_char(char):
-        if char == "blank":
-            return blank
-        elif len(char) > 1:
-            raise ValueError("Characters must be of length 1")
-        return char
 
+def _signature_key(signature):
+    return [[[type(type_).__name__, sorted(vars(type_).items())]
+             for type_ in item.types] + [item.tape]
+            for item in signature]
+
+
+def result_key(machine_def, blank, values):
+    # The key of a run in the result cache: the parsed machine, in a
+    # canonical order, and its input as encoded on the tapes.
+    (machine_type,
+     _,
+     output_signature,
+     transitions,
+     initial_state,
+     final_states,
+     tapes) = machine_def
+
+    return resultcache.key(
+        "turing",
+        list(machine_type),
+        tapes,
+        sorted(json.dumps(transition, ensure_ascii=False)
+               for transition in transitions),
+        initial_state,
+        sorted(final_states),
+        _signature_key(output_signature),
+        initial_tape_runs(machine_def, blank, values))
+
+
+def make_macro_machine(machine, options):
+    import macro
+    return macro.MacroMachine(
+        machine,
+        block_size=options.block_size,
+        cache_size=options.cache_size)
+
+
+def run_machine(machine, options, macro_machine=None, profile=None,
+                recorder=None, checkpointer=None):
+    # runs the machine as configured by the command line options
+    if not isinstance(machine, turing.TuringMachine):
+        if options.engine != "compiled" or options.detect_cycles or \
+                profile is not None or recorder is not None:
+            raise ValueError("multi-tape machines support the compiled engine"
+                             " with --max-steps and --timeout only, without"
+                             " profiling or tracing")
+        machine.run(max_steps=options.max_steps, timeout=options.timeout)
+        return
+
+    if options.engine == "macro":
+        if profile is not None or recorder is not None or \
+                checkpointer is not None:
+            raise ValueError("profiling, tracing and checkpoints need the"
+                             " compiled engine")
+        if macro_machine is None:
+            macro_machine = make_macro_machine(machine, options)
+        macro_machine.run(max_steps=options.max_steps,
+                          timeout=options.timeout,
+                          detect_cycles=options.detect_cycles)
+        return
+
+    machine.run(engine=options.engine,
+                max_steps=options.max_steps,
+                timeout=options.timeout,
+                detect_cycles=options.detect_cycles,
+                profile=profile,
+                recorder=recorder,
+                checkpointer=checkpointer)
+
+
+def decode_output(machine, output_signature):
+    if isinstance(machine, turing.TuringMachine):
+        return [outputtype.from_turing_runs(runs)
+                for runs, outputtype in zip(machine.output_runs(),
+                                            output_signature)]
+
+    # the values of each tape, in the order of the signature
+    tapes = [iter(values) for values in machine.output()]
+    values = [next(tapes[outputtype.tape])
+              for outputtype in output_signature]
+    return [outputtype.from_turing_output(value)
+            for value, outputtype in zip(values, output_signature)]
+
+
+def _batch_error(lineno, err):
+    # the result of a batch line which could not be read
+    return {"args": None,
+            "line": lineno,
+            "status": "error",
+            "error": "line {}: {}".format(lineno, err)}
+
+
+def read_batch(f, fmt):
+    # Yields the argument tuples of a batch file one by one. Lines which
+    # cannot be read yield their error result instead, so that the rest of
+    # the batch still runs.
+    if fmt == "jsonl":
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                values = json.loads(line)
+                if isinstance(values, dict):
+                    values = values.get("args")
+                if not isinstance(values, list):
+                    raise ValueError("batch lines must be JSON arrays or"
+                                     " objects with an args array")
+            except ValueError as err:
+                yield _batch_error(lineno, err)
+                continue
+            yield [str(value) for value in values]
+    else:
+        reader = csv.reader(f)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as err:
+                yield _batch_error(reader.line_num, err)
+                continue
+            if row:
+                yield [value.strip() for value in row]
+
+
+_batch_setup = None
+
+
+def _init_batch(machine_def, blank, options):
+    global _batch_setup
+    _batch_setup = machine_def, blank, options
+
+
+def _run_batch_item(values):
+    if isinstance(values, dict):
+        # a line which could not be read
+        return values
+    machine_def, blank, options = _batch_setup
+    result = {"args": values}
+    machine = None
     try:
-        transitions = [
-            (qp, map_char(r), map_char(w), direction_map[direction], qn)
-            for qp, r, w, direction, qn in transitions]
-    except KeyError as err:
-        raise ValueError("Unknown direction: {}".format(str(err)[1:-1]))
+        machine = build_machine(machine_def, blank, values)
+        run_machine(machine, options)
+    except ValueError as err:
+        result["status"] = "error"
+        result["error"] = str(err)
+    except turing.BudgetExhausted as err:
+        result["status"] = "budget"
+        result["error"] = str(err)
+    except turing.NonTerminating as err:
+        result["status"] = "looping"
+        result["error"] = str(err)
+    else:
+        result["status"] = "ok"
+        result["outputs"] = decode_output(machine, machine_def[2])
+
+    if machine is not None:
+        result["state"] = machine.state
+        result["steps"] = machine.steps
+    return result
+
+
+def _run_lockstep_chunk(chunk):
+    import lockstep
+
+    machine_def, blank, options = _batch_setup
+    (_,
+     _,
+     output_signature,
+     transitions,
+     initial_state,
+     final_states,
+     _) = machine_def
+
+    results = [values if isinstance(values, dict) else {"args": values}
+               for values in chunk]
+    tapes = []
+    lanes = []
+    for result in results:
+        if "status" in result:
+            continue
+        try:
+            tapes.append(initial_tape(machine_def, blank, result["args"]))
+        except ValueError as err:
+            result["status"] = "error"
+            result["error"] = str(err)
+        else:
+            lanes.append(result)
 
+    machines = lockstep.LockstepMachine(
+        tapes,
+        transitions,
+        initial_state,
+        final_states,
+        blank=blank,
+        outputs=len(output_signature))
+    machines.run(max_steps=options.max_steps)
+
+    for lane, result in enumerate(lanes):
+        status = machines.status[lane]
+        if status == machines.HALTED:
+            result["status"] = "ok"
+            result["outputs"] = [
+                outputtype.from_turing_output(value)
+                for value, outputtype in zip(machines.output(lane),
+                                             output_signature)]
+        elif status == machines.STUCK:
+            result["status"] = "error"
+            result["error"] = "no transition found from current state"
+        else:
+            result["status"] = "budget"
+            result["error"] = "step budget of {} exhausted".format(
+                options.max_steps)
+        result["state"] = machines.state(lane)
+        result["steps"] = int(machines.steps[lane])
+
+    return results
+
+
+def _run_batch_chunk(chunk):
+    if _batch_setup[2].engine == "lockstep":
+        return _run_lockstep_chunk(chunk)
+    return [_run_batch_item(values) for values in chunk]
+
+
+def run_batch(rows, machine_def, blank, options, workers, chunk_size=64):
+    # Yields the results in the order of the rows. Rows are read lazily and
+    # only a bounded number of chunks is in flight at any time.
+    rows = iter(rows)
+    if workers <= 1:
+        _init_batch(machine_def, blank, options)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield from _run_batch_chunk(chunk)
+
+    with concurrent.futures.ProcessPoolExecutor(
+            workers,
+            initializer=_init_batch,
+            initargs=(machine_def, blank, options)) as pool:
+        pending = collections.deque()
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if chunk:
+                pending.append(pool.submit(_run_batch_chunk, chunk))
+            if pending and (not chunk or len(pending) >= 4*workers):
+                yield from pending.popleft().result()
+            elif not chunk:
+                return
 
-    return (machine_type, input_signature, output_signature, transitions,
-            initial_state, final_states)
 
 if __name__ == "__main__":
     import argparse
-    import os
-    import sys
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -289,6 +897,152 @@ if __name__ == "__main__":
         default="X",
         help="Blank symbol. By default, this is X"
         )
+    parser.add_argument(
+        "-e", "--engine",
+        default="compiled",
+        choices=("compiled", "interpreted", "sweep", "macro", "jit",
+                 "lockstep"),
+        help="Execution engine. The compiled engine runs on an interned"
+        " transition table, the interpreted one steps through the transition"
+        " dictionaries (slow, but logs every step). The sweep engine works on"
+        " a run-length encoded tape and crosses runs of a symbol on which a"
+        " state loops in one go. The macro engine steps over blocks of cells"
+        " with cached block transitions. The jit engine generates and compiles"
+        " Python code specific to the machine (cached below"
+        " $XDG_CACHE_HOME/til-turing). The lockstep engine (--batch only,"
+        " needs numpy) runs many inputs at once on NumPy arrays. By default,"
+        " this is compiled")
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=8,
+        help="Cells per block of the macro engine. By default, this is 8")
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=2**16,
+        help="Number of block transitions the macro engine keeps cached. By"
+        " default, this is 65536")
+    parser.add_argument(
+        "--max-steps",
+        type=int,
+        default=None,
+        help="Give up after this many steps (exit code {})".format(
+            EXIT_BUDGET))
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Give up after this much time (exit code {})".format(
+            EXIT_BUDGET))
+    parser.add_argument(
+        "--detect-cycles",
+        action="store_true",
+        default=False,
+        help="Check periodically whether the machine provably runs forever,"
+        " either repeating a configuration or drifting into blank tape"
+        " (exit code {})".format(EXIT_LOOPING))
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        default=None,
+        help="Run the machine once for each argument tuple in FILE (- for"
+        " STDIN), one tuple per line, and print one JSON result per line in"
+        " the same order")
+    parser.add_argument(
+        "--batch-format",
+        choices=("csv", "jsonl"),
+        default=None,
+        help="Format of the batch file: comma separated values or one JSON"
+        " array per line. By default, this is guessed from the file name")
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes for --batch and for the search of"
+        " nondeterministic machines. By default, this is the number of CPUs"
+        " with --batch and 1 otherwise")
+    parser.add_argument(
+        "--max-configurations",
+        type=int,
+        default=None,
+        help="Give up on a nondeterministic machine once the search has seen"
+        " this many configurations (exit code {})".format(EXIT_BUDGET))
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        help="Count the steps per state and transition, the distance the"
+        " head travelled, the cells visited and the time spent, and print a"
+        " report sorted by hits to STDERR (compiled engine only)")
+    parser.add_argument(
+        "--profile-json",
+        metavar="FILE",
+        default=None,
+        help="Like --profile, but write the counters as JSON to FILE")
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        default=None,
+        help="Record every step in the binary trace FILE (and checkpoints in"
+        " FILE.ckpt), to be inspected with replay-trace.py (compiled engine"
+        " only)")
+    parser.add_argument(
+        "--trace-checkpoint-every",
+        type=int,
+        default=2**16,
+        metavar="STEPS",
+        help="Steps between two checkpoints in the trace. By default, this"
+        " is 65536")
+    parser.add_argument(
+        "--checkpoint",
+        metavar="FILE",
+        default=None,
+        help="Periodically save the state of the machine to FILE, and once"
+        " more when a budget is exhausted")
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=None,
+        metavar="STEPS",
+        help="Steps between two checkpoints (rounded up to {} steps)".format(
+            turing.TuringMachine.check_interval))
+    parser.add_argument(
+        "--checkpoint-seconds",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Seconds between two checkpoints. By default, this is 60 unless"
+        " --checkpoint-every is given")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Continue from the --checkpoint FILE if it exists, instead of"
+        " starting with the arguments. Step budgets count the steps before"
+        " the checkpoint, too")
+    parser.add_argument(
+        "--no-result-cache",
+        action="store_true",
+        default=False,
+        help="Neither look up nor store the result in the result cache below"
+        " $XDG_CACHE_HOME/til-results, which otherwise returns the outputs of"
+        " earlier runs of the same machine on the same input without running"
+        " it. Runs which are traced, profiled or checkpointed bypass the"
+        " cache anyway")
+    parser.add_argument(
+        "--refresh-result-cache",
+        action="store_true",
+        default=False,
+        help="Run the machine even if its result is cached, and store the"
+        " new result")
+    parser.add_argument(
+        "--no-machine-cache",
+        action="store_true",
+        default=False,
+        help="Always parse the machine file, instead of loading it from (and"
+        " storing it in) the machine cache below $XDG_CACHE_HOME/til-turing")
     parser.add_argument(
         "infile",
         help="File containing the machine definition"
@@ -313,42 +1067,182 @@ if __name__ == "__main__":
         level=loglevel
     )
 
-    with open(args.infile, "r") as f:
-        lines = f.readlines()
-
     (machine_type,
      input_signature,
      output_signature,
      transitions,
      initial_state,
-     final_states) = parse_machine(lines, args.blank)
-
-    import turing
-
-    if len(input_signature) != len(args.args):
-        raise ValueError("Turing machine expects {} input(s), but {}"
-                         " given".format(len(input_signature),
-                                         len(args.args)))
-
-    initial_tape = []
-    for arg, inputtype in zip(args.args, input_signature):
-        initial_tape += list(inputtype.to_turing_input(arg))
-        initial_tape.append(args.blank)
-
-    machine = turing.TuringMachine(
-        initial_tape,
-        transitions,
-        initial_state,
-        final_states,
-        blank=args.blank,
-        outputs=len(output_signature))
+     final_states,
+     tapes) = load_machine(args.infile, args.blank,
+                           use_cache=not args.no_machine_cache)
+
+    machine_def = (machine_type,
+                   input_signature,
+                   output_signature,
+                   transitions,
+                   initial_state,
+                   final_states,
+                   tapes)
+
+    profiling = args.profile or args.profile_json is not None
+    if (profiling or args.trace is not None or
+            args.checkpoint is not None) and \
+            (args.batch is not None or machine_type[0] == "ntm" or
+             tapes > 1):
+        raise ValueError("profiling, tracing and checkpoints are only"
+                         " available for single runs of single tape,"
+                         " deterministic machines")
+    if args.resume and args.checkpoint is None:
+        raise ValueError("--resume needs --checkpoint")
+
+    if args.batch is not None:
+        if machine_type[0] == "ntm":
+            raise ValueError("--batch is not supported for nondeterministic"
+                             " machines")
+        if args.args:
+            raise ValueError("--batch and arguments are mutually exclusive")
+
+        fmt = args.batch_format
+        if fmt is None:
+            fmt = "jsonl" if args.batch.endswith((".jsonl", ".json")) \
+                else "csv"
+
+        if args.batch == "-":
+            batch_file = sys.stdin
+        else:
+            batch_file = open(args.batch, "r", newline="")
+
+        if args.engine == "lockstep":
+            if tapes > 1:
+                raise ValueError("the lockstep engine runs single tape"
+                                 " machines only")
+            if args.timeout is not None or args.detect_cycles:
+                raise ValueError("the lockstep engine supports --max-steps"
+                                 " only")
+            chunk_size = 1024
+        else:
+            chunk_size = 64
+
+        with batch_file:
+            for result in run_batch(read_batch(batch_file, fmt),
+                                    machine_def,
+                                    args.blank,
+                                    args,
+                                    args.jobs or os.cpu_count() or 1,
+                                    chunk_size=chunk_size):
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+        sys.exit(0)
+
+    if args.engine == "lockstep":
+        raise ValueError("the lockstep engine is only available with --batch")
+
+    if machine_type[0] == "ntm":
+        if args.timeout is not None or args.detect_cycles:
+            raise ValueError("nondeterministic machines support --max-steps"
+                             " and --max-configurations only")
+        machine = build_ntm(machine_def, args.blank, args.args)
+        try:
+            accepted = machine.run(max_steps=args.max_steps,
+                                   max_configurations=args.max_configurations,
+                                   jobs=args.jobs or 1)
+        except turing.BudgetExhausted as err:
+            print("After {} steps and {} configurations:".format(
+                machine.steps, machine.configurations))
+            print(err)
+            sys.exit(EXIT_BUDGET)
+        if args.verbosity:
+            print("{} configurations in {} steps".format(
+                machine.configurations, machine.steps), file=sys.stderr)
+        print("accept" if accepted else "reject")
+        sys.exit(0)
+
+    tracer = None
+    if loglevel <= logging.INFO and not profiling and args.trace is None:
+        tracer = turing.LoggingTracer()
+
+    result_cache = None
+    if not (args.no_result_cache or profiling or tracer is not None or
+            args.trace is not None or args.checkpoint is not None):
+        result_cache = resultcache.ResultCache()
+        key = result_key(machine_def, args.blank, args.args)
+        if not args.refresh_result_cache:
+            result = result_cache.get(key)
+            # a cached run which took more steps than allowed now is run
+            # again, to fail the same way as without the cache
+            if result is not None and (args.max_steps is None or
+                                       result["steps"] <= args.max_steps):
+                if args.verbosity:
+                    print("cached result of {} steps".format(
+                        result["steps"]), file=sys.stderr)
+                for value in result["outputs"]:
+                    print(value)
+                sys.exit(0)
+    if args.resume and os.path.exists(args.checkpoint):
+        machine = turing.TuringMachine.restore(args.checkpoint, tracer=tracer)
+    else:
+        machine = build_machine(machine_def, args.blank, args.args,
+                                tracer=tracer)
+
+    macro_machine = None
+    if args.engine == "macro" and tapes == 1:
+        macro_machine = make_macro_machine(machine, args)
+    profile = turing.Profile() if profiling else None
+    recorder = None
+    if args.trace is not None and tapes == 1:
+        import tracefile
+        recorder = tracefile.TraceWriter(
+            args.trace, machine, checkpoint_every=args.trace_checkpoint_every)
+    checkpointer = None
+    if args.checkpoint is not None:
+        seconds = args.checkpoint_seconds
+        if seconds is None and args.checkpoint_every is None:
+            seconds = 60
+        checkpointer = turing.Checkpointer(args.checkpoint,
+                                           steps=args.checkpoint_every,
+                                           seconds=seconds)
 
     try:
-        machine.run()
+        try:
+            run_machine(machine, args, macro_machine, profile, recorder,
+                        checkpointer)
+        finally:
+            if recorder is not None:
+                recorder.close()
+            if profile is not None and profile.machine is not None:
+                if args.profile:
+                    print(profile.report(), file=sys.stderr)
+                if args.profile_json is not None:
+                    with open(args.profile_json, "w") as f:
+                        json.dump(profile.as_dict(), f, indent=2,
+                                  ensure_ascii=False)
+            if macro_machine is not None and args.verbosity:
+                print("{} steps in {} macro steps, cache hit rate"
+                      " {:.1%}".format(machine.steps,
+                                       macro_machine.macro_steps,
+                                       macro_machine.hit_rate),
+                      file=sys.stderr)
     except ValueError as err:
         print("In state {}:".format(machine.state))
         print(err)
         sys.exit(1)
-
-    for value, outputtype in zip(machine.output(), output_signature):
-        print(outputtype.from_turing_output(value))
+    except turing.BudgetExhausted as err:
+        if checkpointer is not None:
+            checkpointer.take(machine, background=False)
+        print("In state {} after {} steps:".format(machine.state,
+                                                    machine.steps))
+        print(err)
+        sys.exit(EXIT_BUDGET)
+    except turing.NonTerminating as err:
+        print("In state {} after {} steps:".format(machine.state,
+                                                    machine.steps))
+        print(err)
+        sys.exit(EXIT_LOOPING)
+
+    outputs = decode_output(machine, output_signature)
+    if result_cache is not None:
+        result_cache.put(key, {"outputs": outputs,
+                               "steps": machine.steps,
+                               "state": machine.state})
+        result_cache.close()
+    for value in outputs:
+        print(value)
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+
+import array
+import itertools
+
+import turing
+
+
+def _runs(codes):
+    return [[code, len(list(group))]
+            for code, group in itertools.groupby(codes)]
+
+
+class RunLengthTape:
+    # The tape is kept as the symbol under the head and two stacks of
+    # [code, count] runs, one for each side of the head. The last run of
+    # each stack is the one adjacent to the head; adjacent runs always hold
+    # different symbols and the (infinite) blank ends are not stored.
+
+    def __init__(self, tape):
+        cells = tape.cells
+        index = tape.reserve(tape.pos)
+        self.pos = tape.pos
+        self.head = cells[index]
+        self.left = _runs(cells[:index])
+        self.right = _runs(reversed(cells[index+1:]))
+        for side in (self.left, self.right):
+            if side and side[0][0] == 0:
+                del side[0]
+
+    @staticmethod
+    def _push(side, code, count):
+        if side and side[-1][0] == code:
+            side[-1][1] += count
+        elif code or side:
+            side.append([code, count])
+
+    @staticmethod
+    def _pop(side):
+        if not side:
+            return 0
+        run = side[-1]
+        run[1] -= 1
+        if not run[1]:
+            side.pop()
+        return run[0]
+
+    def step(self, write, move):
+        if move > 0:
+            self._push(self.left, write, 1)
+            self.head = self._pop(self.right)
+        elif move < 0:
+            self._push(self.right, write, 1)
+            self.head = self._pop(self.left)
+        else:
+            self.head = write
+        self.pos += move
+
+    def sweep(self, write, move):
+        # Executes a transition which loops on the current state and symbol
+        # for as long as it keeps reading that symbol, and returns the number
+        # of steps this took.
+        if move > 0:
+            ahead, behind = self.right, self.left
+        else:
+            ahead, behind = self.left, self.right
+
+        read = self.head
+        count = 1
+        if ahead and ahead[-1][0] == read:
+            count += ahead.pop()[1]
+        if not read and not ahead:
+            raise turing.NonTerminating(
+                "machine sweeps over blank tape forever")
+
+        self._push(behind, write, count)
+        self.head = self._pop(ahead)
+        self.pos += move * count
+        return count
+
+    def store(self, tape):
+        typecode = tape.cells.typecode
+        cells = array.array(typecode)
+        for code, count in self.left:
+            cells.extend(array.array(typecode, [code]) * count)
+        cells.append(self.head)
+        for code, count in reversed(self.right):
+            cells.extend(array.array(typecode, [code]) * count)
+
+        tape.cells = cells
+        tape.offset = sum(count for _, count in self.left) - self.pos
+        tape.pos = self.pos
+
+
+def run_sweeping(machine):
+    # Runs the machine on a run-length encoded tape. Transitions which keep
+    # the state and move the head are applied to the whole run of the symbol
+    # they read at once, so sweeping over a run costs O(1) instead of O(run
+    # length). The step count is the same as with the other engines.
+    if len(machine.tape.symbols) != machine._nsymbols:
+        machine.compile()
+
+    table = machine._table
+    halting = machine._halting
+    nsymbols = machine._nsymbols
+
+    tape = RunLengthTape(machine.tape)
+    row = machine._state_codes[machine.state] * nsymbols
+    steps = 0
+    transition = ()
+    try:
+        while not halting[row]:
+            transition = table[row + tape.head]
+            if transition is None:
+                break
+            write, move, next_row = transition
+            if next_row == row and move:
+                steps += tape.sweep(write, move)
+            else:
+                tape.step(write, move)
+                steps += 1
+                row = next_row
+    finally:
+        tape.store(machine.tape)
+        machine.steps += steps
+        machine.state = machine._state_names[row // nsymbols]
+
+    if transition is None:
+        raise ValueError("no transition found from current state")
@@ -0,0 +1,271 @@
+#!/usr/bin/python3
+
+import array
+import bisect
+import json
+import mmap
+import struct
+import sys
+
+import turing
+
+# A trace is two files. The trace itself: magic, header length, JSON header,
+# padding up to a multiple of 4 bytes, then one native uint32 per step,
+# holding the state after the step, the symbol written and the move:
+#
+#     state << 10 | symbol << 2 | move + 1
+#
+# and next to it, in <path>.ckpt, a checkpoint of the whole configuration
+# every `checkpoint_every` steps: the _checkpoint struct (step, state, head
+# position, position of the first cell, number of cells, bytes per cell)
+# followed by the cells.
+MAGIC = b"TILTRC\x00\x01"
+_prefix = struct.Struct("<8sI")
+_checkpoint = struct.Struct("<qqqqqq")
+
+_MAX_SYMBOLS = 1 << 8
+_MAX_STATES = 1 << 22
+
+
+def _checkpoint_path(path):
+    return path + ".ckpt"
+
+
+class TraceWriter:
+    # Records every step of a machine run with run(recorder=...). Closing
+    # the writer flushes the checkpoints.
+
+    # steps buffered in memory at most
+    flush_interval = 2**16
+
+    def __init__(self, path, machine, checkpoint_every=2**16):
+        if len(machine.tape.symbols) != machine._nsymbols:
+            machine.compile()
+        nsymbols = machine._nsymbols
+        if nsymbols > _MAX_SYMBOLS or \
+                len(machine._state_names) > _MAX_STATES:
+            raise ValueError("too many symbols or states to trace")
+
+        # the record of each step, by transition table entry
+        self._records = array.array("I", bytes(4 * len(machine._table)))
+        for key, transition in enumerate(machine._table):
+            if transition is not None:
+                write, move, next_row = transition
+                # the move gets two bits of its own
+                if move not in (-1, 0, 1):
+                    raise ValueError("cannot trace a move by {} cells".format(
+                        move))
+                self._records[key] = \
+                    (next_row // nsymbols) << 10 | write << 2 | move + 1
+
+        self.machine = machine
+        self.checkpoint_every = checkpoint_every
+        self._buffer = array.array("I")
+        self._f = open(path, "wb")
+        self._checkpoints = open(_checkpoint_path(path), "wb")
+
+        header = json.dumps({
+            "byteorder": sys.byteorder,
+            "blank": machine.tape.blank,
+            "symbols": machine.tape.symbols,
+            "states": machine._state_names,
+            "start": machine.steps,
+            "checkpoint_every": checkpoint_every,
+        }).encode("utf-8")
+        header += b" " * (-(_prefix.size + len(header)) % 4)
+        self._f.write(_prefix.pack(MAGIC, len(header)))
+        self._f.write(header)
+        self._checkpoint()
+
+    def _checkpoint(self):
+        machine = self.machine
+        tape = machine.tape
+        extent = tape.extent()
+        if extent is None:
+            low = high = tape.pos
+        else:
+            low, high = extent
+        # reserve replaces the buffer when growing it to the left, so both ends
+        # are reserved before the buffer is sliced
+        tape.reserve(low)
+        tape.reserve(high)
+        cells = tape.cells[low+tape.offset:high+tape.offset+1]
+        self._checkpoints.write(_checkpoint.pack(
+            machine.steps,
+            machine._state_codes[machine.state],
+            tape.pos,
+            low,
+            len(cells),
+            cells.itemsize))
+        cells.tofile(self._checkpoints)
+
+    def close(self):
+        self._f.close()
+        self._checkpoints.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def advance(self, machine, limit=None):
+        # the compiled engine, recording each step and pausing for the
+        # checkpoints; the same contract as TuringMachine._run_compiled
+        if limit is None:
+            limit = sys.maxsize
+        every = self.checkpoint_every
+        while True:
+            before = machine.steps
+            try:
+                halted = self._run(machine, min(
+                    limit,
+                    before + every - before % every,
+                    before + self.flush_interval))
+            finally:
+                self._buffer.tofile(self._f)
+                del self._buffer[:]
+            if machine.steps != before and machine.steps % every == 0:
+                self._checkpoint()
+            if halted or machine.steps >= limit:
+                return halted
+
+    def _run(self, machine, limit):
+        if len(machine.tape.symbols) != machine._nsymbols:
+            raise ValueError("symbols were added to the tape while tracing")
+
+        tape = machine.tape
+        table = machine._table
+        halting = machine._halting
+        nsymbols = machine._nsymbols
+        records = self._records
+        record = self._buffer.append
+
+        row = machine._state_codes[machine.state] * nsymbols
+        index = tape.reserve(tape.pos)
+        cells = tape.cells
+        size = len(cells)
+        steps = 0
+        budget = limit - machine.steps
+        transition = ()
+        try:
+            while steps < budget and not halting[row]:
+                key = row + cells[index]
+                transition = table[key]
+                if transition is None:
+                    break
+                record(records[key])
+                cells[index], move, row = transition
+                index += move
+                steps += 1
+                if not 0 <= index < size:
+                    index = tape.reserve(index - tape.offset)
+                    cells = tape.cells
+                    size = len(cells)
+        finally:
+            tape.pos = index - tape.offset
+            machine.steps += steps
+            machine.state = machine._state_names[row // nsymbols]
+
+        if transition is None:
+            raise ValueError("no transition found from current state")
+        return halting[row]
+
+
+class TraceReader:
+    # Memory maps a trace and reconstructs the configuration after any step
+    # from the last checkpoint before it.
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(_checkpoint_path(path), "rb") as f:
+            self._checkpoint_map = mmap.mmap(f.fileno(), 0,
+                                             access=mmap.ACCESS_READ)
+
+        magic, header_size = _prefix.unpack_from(self._mapped)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("not a trace file: {}".format(path))
+        start = _prefix.size + header_size
+        header = json.loads(
+            self._mapped[_prefix.size:start].decode("utf-8"))
+        if header["byteorder"] != sys.byteorder:
+            self.close()
+            raise ValueError("trace was written on another byte order")
+        self.blank = header["blank"]
+        self.symbols = header["symbols"]
+        self.states = header["states"]
+        self.start = header["start"]
+
+        # a record may have been cut short by a killed writer
+        end = start + (len(self._mapped) - start) // 4 * 4
+        self._whole = memoryview(self._mapped)
+        self._raw = self._whole[start:end]
+        self._records = self._raw.cast("I")
+
+        # (step, offset) of each complete checkpoint
+        self._checkpoints = []
+        offset = 0
+        while offset + _checkpoint.size <= len(self._checkpoint_map):
+            step, _, _, _, count, itemsize = _checkpoint.unpack_from(
+                self._checkpoint_map, offset)
+            size = _checkpoint.size + count * itemsize
+            if offset + size > len(self._checkpoint_map):
+                break
+            self._checkpoints.append((step, offset))
+            offset += size
+
+    def close(self):
+        if hasattr(self, "_records"):
+            self._records.release()
+            self._raw.release()
+            self._whole.release()
+        self._mapped.close()
+        self._checkpoint_map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        # the last step in the trace
+        return self.start + len(self._records)
+
+    def record(self, step):
+        # (state, symbol written, move) of the given step
+        value = self._records[step - self.start - 1]
+        return (self.states[value >> 10],
+                self.symbols[(value >> 2) & 0xff],
+                (value & 3) - 1)
+
+    def configuration(self, step):
+        # the state and tape after the given step
+        if not self.start <= step <= len(self):
+            raise IndexError("step {} is not in the trace".format(step))
+        i = bisect.bisect_right(self._checkpoints, (step, sys.maxsize)) - 1
+        first, offset = self._checkpoints[i]
+        _, state, pos, low, count, itemsize = _checkpoint.unpack_from(
+            self._checkpoint_map, offset)
+        offset += _checkpoint.size
+
+        tape = turing.Tape((), self.blank, self.symbols[1:])
+        cells = array.array("B" if itemsize == 1 else "L")
+        cells.frombytes(self._checkpoint_map[offset:offset+count*itemsize])
+        tape.cells = cells
+        tape.offset = -low
+        tape.pos = pos
+
+        index = tape.reserve(pos)
+        cells = tape.cells
+        for value in self._records[first-self.start:step-self.start]:
+            cells[index] = (value >> 2) & 0xff
+            index += (value & 3) - 1
+            if not 0 <= index < len(cells):
+                index = tape.reserve(index - tape.offset)
+                cells = tape.cells
+            state = value >> 10
+        tape.pos = index - tape.offset
+        return self.states[state], tape
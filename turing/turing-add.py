@@ -1,6 +1,6 @@
 #!/usr/bin/python3
 
-from turing import TuringMachine
+from turing import TuringMachine, LoggingTracer
 import logging
 import argparse
 
@@ -20,7 +20,7 @@ def pos_int(val):
 parser = argparse.ArgumentParser()
 parser.add_argument("a", type=pos_int)
 parser.add_argument("b", type=pos_int)
-parser.add_argument("-v", "--verbosity", action="count",
+parser.add_argument("-v", "--verbosity", action="count", default=0,
                     help="Increase verbosity")
 
 args = parser.parse_args()
@@ -56,7 +56,9 @@ transitions = {(q0, a, a, 1, q0),
                (q5, a, a, -1, q5),
                (q5, blank, blank, 1, qf)}
 
-machine = TuringMachine(tape, transitions, q0, {qf})
+machine = TuringMachine(tape, transitions, q0, {qf},
+                        tracer=LoggingTracer() if loglevel <= logging.INFO
+                        else None)
 machine.run()
 output = machine.output()
 print(len(output[0]))
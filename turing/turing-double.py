@@ -1,6 +1,6 @@
 #!/usr/bin/python3
 
-from turing import TuringMachine
+from turing import TuringMachine, LoggingTracer
 import logging
 import argparse
 
@@ -19,13 +19,15 @@ def pos_int(val):
 
 parser = argparse.ArgumentParser()
 parser.add_argument("a", type=pos_int)
-parser.add_argument("-v", "--verbosity", action="count",
+parser.add_argument("-v", "--verbosity", action="count", default=0,
                     help="Increase verbosity")
 
 args = parser.parse_args()
 loglevel = {0: logging.WARNING,
-            1: logging.INFO,
-            2: logging.DEBUG}.get(args.verbosity)
+            1: logging.INFO}.get(args.verbosity, logging.DEBUG)
+
+logging.basicConfig(format='[{name}] [{levelname}] {message}',
+                    style="{", level=loglevel)
 
 
 a = "a"
@@ -61,7 +63,9 @@ transitions = {(q0, bl, bl, n, stop),
                (q4, b, a, l, q4),
                (q4, bl, bl, r, stop)}
 
-machine = TuringMachine(tape, transitions, q0, {stop}, loglevel=loglevel)
+machine = TuringMachine(tape, transitions, q0, {stop},
+                        tracer=LoggingTracer() if loglevel <= logging.INFO
+                        else None)
 machine.run()
 output = machine.output()
 print(len(output[0]))
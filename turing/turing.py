@@ -1,103 +1,714 @@
 #!/usr/bin/python3
 
+import array
 import collections
+import functools
+import itertools
+import json
 import logging
+import os
+import re
+import struct
+import sys
+import threading
+import time
 
 Transition = collections.namedtuple("Transition", ["wchar", "move_head",
                                                    "new_state"])
 
+# a configuration yielded by TuringMachine.iter_steps
+StepView = collections.namedtuple("StepView", ["steps", "state", "head",
+                                               "start", "cells"])
 
-class Tape(collections.defaultdict):
-    logger = logging.getLogger(__qualname__)
 
-    def __init__(self, data, blank):
-        super().__init__(lambda: blank)
+# Checkpoint layout: magic, header length, JSON header, padding up to a
+# multiple of 4 bytes, the transitions as native int32 quintuples of (state,
+# read, write, move, next state) and the cells between the outermost
+# non-blank cells (and the head). States and symbols are indices into the
+# header's lists.
+CHECKPOINT_MAGIC = b"TILCKP\x00\x01"
+_checkpoint_prefix = struct.Struct("<8sI")
 
-        if not data:
-            data = [blank]
 
-        for i in range(len(data)):
-            self[i] = data[i]
+@functools.lru_cache(maxsize=None)
+def _other_than(code):
+    # matches any byte sized cell but code
+    return re.compile("[^\\x{:02x}]".format(code).encode("ascii"))
 
-        self.pos = 0
+
+class BudgetExhausted(Exception):
+    pass
+
+
+class NonTerminating(Exception):
+    pass
+
+
+class Tape:
+    def __init__(self, data, blank, alphabet=()):
         self.blank = blank
+        self.symbols = [blank]
+        self.codes = {blank: 0}
+
+        # interning the alphabet first keeps the codes of a machine's symbols
+        # independent of its input
+        for char in alphabet:
+            self.intern(char)
+
+        codes = [self.intern(char) for char in data]
+        if not codes:
+            codes = [0]
+
+        self.cells = array.array(self._typecode(), codes)
+        # buffer index of the logical cell 0
+        self.offset = 0
+        self.pos = 0
+
+    @classmethod
+    def from_runs(cls, runs, blank, alphabet=()):
+        # Like Tape(data, blank, alphabet), with the data given as (symbol,
+        # count) runs. Each run is filled in one go.
+        tape = cls((), blank, alphabet)
+        runs = [(tape.intern(char), count) for char, count in runs]
+        cells = array.array(tape._typecode())
+        for code, count in runs:
+            cells.extend(array.array(cells.typecode, [code]) * count)
+        if cells:
+            tape.cells = cells
+        return tape
+
+    def _typecode(self):
+        if len(self.symbols) <= 0x100:
+            return "B"
+        return "L"
+
+    def intern(self, char):
+        try:
+            return self.codes[char]
+        except KeyError:
+            pass
+
+        code = len(self.symbols)
+        self.symbols.append(char)
+        self.codes[char] = code
+        cells = getattr(self, "cells", None)
+        if cells is not None and cells.typecode != self._typecode():
+            self.cells = array.array(self._typecode(), cells)
+        return code
+
+    def reserve(self, pos):
+        # returns the buffer index of pos, growing the buffer by (at least)
+        # doubling it towards pos if needed
+        index = pos + self.offset
+        size = len(self.cells)
+        if index < 0:
+            extra = max(size, -index)
+            self.cells = array.array(self.cells.typecode, [0]) * extra \
+                + self.cells
+            self.offset += extra
+            index += extra
+        elif index >= size:
+            extra = max(size, index - size + 1)
+            self.cells.extend(array.array(self.cells.typecode, [0]) * extra)
+        return index
+
+    def extent(self):
+        # logical positions of the outermost non-blank cells, or None
+        cells = self.cells
+        lower = 0
+        upper = len(cells)
+        while lower < upper and not cells[lower]:
+            lower += 1
+        while upper > lower and not cells[upper-1]:
+            upper -= 1
+        if lower == upper:
+            return None
+        return lower - self.offset, upper - 1 - self.offset
+
+    def __getitem__(self, pos):
+        index = pos + self.offset
+        if 0 <= index < len(self.cells):
+            return self.symbols[self.cells[index]]
+        return self.blank
+
+    def __setitem__(self, pos, char):
+        code = self.intern(char)
+        # reserve may replace the buffer, so it has to run before the
+        # buffer is looked up
+        index = self.reserve(pos)
+        self.cells[index] = code
 
     def __str__(self):
-        upper = max(max(self), self.pos)
-        lower = min(min(self), self.pos)
-        ret = ""
+        extent = self.extent()
+        if extent is None:
+            lower = upper = self.pos
+        else:
+            lower = min(extent[0], self.pos)
+            upper = max(extent[1], self.pos)
+
+        ret = []
         for k in range(lower, upper+1):
             if k == self.pos:
-                ret += "[{}]".format(str(self[k]))
+                ret.append("[{}]".format(str(self[k])))
             else:
-                ret += str(self[k])
+                ret.append(str(self[k]))
 
-        return ret
+        return "".join(ret)
 
     def move(self, movement):
         self.pos += movement
-        self.logger.debug("head moved by {}".format(movement))
 
     def read(self):
-        self.logger.debug("read {}".format(self[self.pos]))
-        return self[self.pos]
+        index = self.pos + self.offset
+        if 0 <= index < len(self.cells):
+            return self.symbols[self.cells[index]]
+        return self.blank
 
     def write(self, char):
-        self[self.pos] = char
-        self.logger.debug("wrote {}".format(char))
+        try:
+            code = self.codes[char]
+        except KeyError:
+            code = self.intern(char)
+        index = self.reserve(self.pos)
+        self.cells[index] = code
 
     def read_vars(self, num):
         blanks_left = num - 1
-        pos = self.pos
-        ret = [""]
+        index = self.reserve(self.pos)
+        cells = self.cells
+        symbols = self.symbols
+        ret = [[]]
         while True:
-            if self[pos] == self.blank:
+            if index >= len(cells) or not cells[index]:
                 if blanks_left:
-                    ret.append("")
+                    ret.append([])
                     blanks_left -= 1
                 else:
-                    return ret
+                    return ["".join(var) for var in ret]
             else:
-                ret[-1] += self[pos]
+                ret[-1].append(symbols[cells[index]])
+
+            index += 1
+
+    def read_runs(self, num):
+        # Like read_vars, but returns each value as a list of (symbol,
+        # count) runs. The runs are found by a regular expression on the
+        # buffer, so long runs are not walked cell by cell in Python.
+        index = self.reserve(self.pos)
+        cells = self.cells
+        symbols = self.symbols
+        if cells.itemsize == 1:
+            with memoryview(cells) as view:
+                runs = list(self._scan_runs(view, index, num))
+        else:
+            runs = [(code, len(list(group)))
+                    for code, group in itertools.groupby(cells[index:])]
+
+        ret = [[]]
+        for code, count in runs:
+            if code:
+                ret[-1].append((symbols[code], count))
+                continue
+            # every blank ends a value
+            for _ in range(count):
+                if len(ret) == num:
+                    return ret
+                ret.append([])
+        while len(ret) < num:
+            ret.append([])
+        return ret
+
+    @staticmethod
+    def _scan_runs(view, index, num):
+        # the (code, count) runs of a byte buffer from index on, up to the
+        # num-th blank
+        blanks = 0
+        end = len(view)
+        while index < end:
+            code = view[index]
+            m = _other_than(code).search(view, index)
+            stop = end if m is None else m.start()
+            yield code, stop - index
+            if not code:
+                blanks += stop - index
+                if blanks >= num:
+                    return
+            index = stop
+
+
+class Tracer:
+    # Hooks called by TuringMachine.run. Whether a tracer is attached is
+    # checked once per run; without one, nothing is formatted per step.
+
+    def on_step(self, machine, rchar, transition):
+        pass
+
+    def on_halt(self, machine):
+        pass
+
+    def on_error(self, machine, error):
+        pass
+
+
+class LoggingTracer(Tracer):
+    def __init__(self, logger=None):
+        if logger is None:
+            logger = logging.getLogger(TuringMachine.__qualname__)
+        self.logger = logger
+
+    def on_step(self, machine, rchar, transition):
+        logger = self.logger
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("read {}".format(rchar))
+            logger.debug("wrote {}".format(transition.wchar))
+            logger.debug("head moved by {}".format(transition.move_head))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("step done. current state: {} {}".format(
+                machine.state, machine.tape))
+
+    def on_halt(self, machine):
+        self.logger.info("machine stopped in state {}".format(machine.state))
+
+    def on_error(self, machine, error):
+        self.logger.info("machine stopped in state {}: {}".format(
+            machine.state, error))
+
+
+class Profile:
+    # Counters filled by TuringMachine.run(profile=...). hits counts the
+    # steps per entry of the machine's transition table, i.e. per (state,
+    # symbol); low and high are the outermost logical cells the head
+    # visited.
+
+    def __init__(self):
+        self.machine = None
+        self.hits = array.array("Q")
+        self.steps = 0
+        self.seconds = 0.0
+        self.low = None
+        self.high = None
+
+    def _attach(self, machine):
+        if self.machine is not machine or \
+                len(self.hits) != len(machine._table):
+            self.machine = machine
+            self.hits = array.array("Q", bytes(8 * len(machine._table)))
+
+    def transitions(self):
+        # (hits, state, symbol, transition) of the transitions taken, the
+        # hottest first
+        machine = self.machine
+        nsymbols = machine._nsymbols
+        symbols = machine.tape.symbols
+        ret = []
+        for i, hits in enumerate(self.hits):
+            if hits:
+                state, symbol = divmod(i, nsymbols)
+                state = machine._state_names[state]
+                ret.append((hits, state, symbols[symbol],
+                            machine.transitions[state][symbols[symbol]]))
+        ret.sort(key=lambda item: item[0], reverse=True)
+        return ret
+
+    def states(self):
+        counts = collections.Counter()
+        for hits, state, _, _ in self.transitions():
+            counts[state] += hits
+        return counts.most_common()
+
+    def head_travel(self):
+        return sum(hits * abs(transition.move_head)
+                   for hits, _, _, transition in self.transitions())
+
+    def as_dict(self):
+        return {
+            "steps": self.steps,
+            "seconds": self.seconds,
+            "head_travel": self.head_travel(),
+            "low": self.low,
+            "high": self.high,
+            "cells": 0 if self.low is None else self.high - self.low + 1,
+            "states": [{"state": state, "hits": hits}
+                       for state, hits in self.states()],
+            "transitions": [{"state": state,
+                             "symbol": symbol,
+                             "write": transition.wchar,
+                             "move": transition.move_head,
+                             "next": transition.new_state,
+                             "hits": hits}
+                            for hits, state, symbol, transition
+                            in self.transitions()],
+        }
+
+    def report(self, limit=20):
+        lines = [
+            "{} steps in {:.3f}s, head travelled {} cells, visited cells {}"
+            " to {}".format(self.steps, self.seconds, self.head_travel(),
+                            self.low, self.high),
+            "",
+            "{:>12} {:>7}  state".format("hits", "share"),
+        ]
+        total = self.steps or 1
+        for state, hits in self.states()[:limit]:
+            lines.append("{:>12} {:>7.1%}  {}".format(hits, hits / total,
+                                                      state))
+        lines += ["", "{:>12} {:>7}  transition".format("hits", "share")]
+        for hits, state, symbol, transition in self.transitions()[:limit]:
+            lines.append("{:>12} {:>7.1%}  ({}, {}, {}, {}, {})".format(
+                hits, hits / total, state, symbol, transition.wchar,
+                transition.move_head, transition.new_state))
+        return "\n".join(lines)
+
+
+class Checkpointer:
+    # Checkpoints a machine to path every `steps` steps and/or `seconds`
+    # seconds while it runs with run(checkpointer=...). Both are checked
+    # between the chunks of check_interval steps. The snapshot is copied
+    # in the step loop and written by a background thread, one at a time.
+
+    def __init__(self, path, steps=None, seconds=None):
+        self.path = path
+        self.steps = steps
+        self.seconds = seconds
+        self.written = 0
+        self._last_steps = None
+        self._last_time = time.monotonic()
+        self._writer = None
+
+    def sample(self, machine):
+        if self._last_steps is None:
+            self._last_steps = machine.steps
+        if (self.steps is not None and
+                machine.steps - self._last_steps >= self.steps) or \
+                (self.seconds is not None and
+                 time.monotonic() - self._last_time >= self.seconds):
+            self.take(machine)
 
-            pos += 1
+    def take(self, machine, background=True):
+        self.wait()
+        self._last_steps = machine.steps
+        self._last_time = time.monotonic()
+        self._writer = machine.checkpoint(self.path, background=background)
+        self.written += 1
+
+    def wait(self):
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
 
 
 class TuringMachine:
     logger = logging.getLogger(__qualname__)
 
-    def __init__(self, tape, transitions, initial_state, accepting_states,
-                 blank="b̸", outputs=1):
+    engines = ("compiled", "interpreted", "sweep", "macro", "jit")
 
-        self.tape = Tape(tape, blank=blank)
+    # steps between two checks of the budgets and the cycle detector
+    check_interval = 2**14
 
-        self._state = None
-        self.states = set()
-        self.state = initial_state
-        self.accepting_states = accepting_states
+    def __init__(self, tape, transitions, initial_state, accepting_states,
+                 blank="b̸", outputs=1, tracer=None, tape_runs=None):
+        # The tape is given as a sequence of symbols, or as (symbol, count)
+        # runs with tape_runs, in which case tape is ignored.
 
         self.transitions = dict()
+        alphabet = set()
         for state, rchar, wchar, move_head, new_state in transitions:
             self.transitions.setdefault(state, {})[rchar] = Transition(
                 wchar,
                 move_head,
                 new_state)
+            alphabet.add(rchar)
+            alphabet.add(wchar)
+        alphabet.discard(blank)
+
+        alphabet = sorted(alphabet, key=str)
+        if tape_runs is not None:
+            self.tape = Tape.from_runs(tape_runs, blank, alphabet)
+        else:
+            self.tape = Tape(tape, blank=blank, alphabet=alphabet)
+
+        self._state = None
+        self.states = set()
+        self.state = initial_state
+        self.accepting_states = accepting_states
+        self.steps = 0
 
         self.outputs = outputs
+        self.tracer = tracer
+
+        self.compile()
 
-        self.logger.info("machine initialized. current state: {} {}".format(
-            self.state, self.tape))
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(
+                "machine initialized. current state: {} {}".format(
+                    self.state, self.tape))
+
+    def compile(self):
+        # Interns the states to dense integers and flattens the transitions
+        # into a table indexed by state * len(symbols) + symbol. Entries are
+        # (write, move, next) with next being premultiplied, i.e. the offset
+        # of the next state's row in the table.
+        names = []
+        codes = {}
+
+        def intern(state):
+            if state not in codes:
+                codes[state] = len(names)
+                names.append(state)
+
+        intern(self.state)
+        for state, row in self.transitions.items():
+            intern(state)
+            for transition in row.values():
+                intern(transition.new_state)
+        for state in self.accepting_states:
+            intern(state)
+
+        symbols = self.tape.codes
+        nsymbols = len(self.tape.symbols)
+        table = [None] * (len(names) * nsymbols)
+        for state, row in self.transitions.items():
+            base = codes[state] * nsymbols
+            for rchar, transition in row.items():
+                table[base + symbols[rchar]] = (
+                    symbols[transition.wchar],
+                    transition.move_head,
+                    codes[transition.new_state] * nsymbols)
+
+        halting = [False] * len(table)
+        for state in self.accepting_states:
+            halting[codes[state] * nsymbols] = True
+
+        self.states.update(names)
+        self._state_names = names
+        self._state_codes = codes
+        self._nsymbols = nsymbols
+        self._table = table
+        self._halting = halting
+
+    def run(self, engine="compiled", max_steps=None, timeout=None,
+            detect_cycles=False, profile=None, recorder=None,
+            checkpointer=None):
+        # With a Profile, the machine runs on a copy of the compiled engine
+        # which also counts into it. The same goes for recording the steps
+        # with a tracefile.TraceWriter.
+        if engine not in self.engines:
+            raise ValueError("unknown engine: {}".format(engine))
 
-    def run(self):
         self.logger.info("machine started")
+        tracer = self.tracer
+        if profile is not None or recorder is not None:
+            if engine != "compiled" or tracer is not None or \
+                    (profile is not None and recorder is not None):
+                raise ValueError("profiling and recording need the compiled"
+                                 " engine, no tracer and each other")
+        if profile is not None:
+            advance = functools.partial(self._run_profiled, profile)
+        elif recorder is not None:
+            advance = functools.partial(recorder.advance, self)
+        elif tracer is not None:
+            advance = functools.partial(self._run_traced, tracer)
+        elif engine == "compiled":
+            advance = self._run_compiled
+        elif engine == "interpreted":
+            advance = self._run_interpreted
+        else:
+            if engine != "macro" and (max_steps is not None or
+                                      timeout is not None or detect_cycles) \
+                    or checkpointer is not None:
+                raise ValueError("budgets, cycle detection and checkpoints are"
+                                 " not supported by the {} engine".format(
+                                     engine))
+            advance = None
+
+        if advance is None:
+            if engine == "sweep":
+                import sweep
+                sweep.run_sweeping(self)
+            elif engine == "macro":
+                import macro
+                macro.MacroMachine(self).run(max_steps=max_steps,
+                                             timeout=timeout,
+                                             detect_cycles=detect_cycles)
+            elif engine == "jit":
+                import jit
+                jit.run_jit(self)
+        elif max_steps is None and timeout is None and not detect_cycles \
+                and checkpointer is None:
+            advance()
+        else:
+            try:
+                self._run_budgeted(advance, max_steps, timeout,
+                                   detect_cycles, checkpointer)
+            finally:
+                if checkpointer is not None:
+                    checkpointer.wait()
+
+    def _run_budgeted(self, advance, max_steps, timeout, detect_cycles,
+                      checkpointer=None):
+        # The engine runs in chunks of check_interval steps; the budgets,
+        # the cycle detector and the checkpointer are only looked at in
+        # between.
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        if detect_cycles:
+            import deciders
+            detector = deciders.CycleDetector()
+
+        while True:
+            limit = self.steps + self.check_interval
+            if max_steps is not None:
+                limit = min(limit, max_steps)
+            if advance(limit):
+                return
+
+            if max_steps is not None and self.steps >= max_steps:
+                raise BudgetExhausted(
+                    "step budget of {} exhausted".format(max_steps))
+            if timeout is not None and time.monotonic() >= deadline:
+                raise BudgetExhausted(
+                    "time budget of {}s exhausted".format(timeout))
+            if detect_cycles:
+                detector.sample(self)
+            if checkpointer is not None:
+                checkpointer.sample(self)
+
+    # Each of the stepping engines below runs until the machine halts
+    # (returning True), gets stuck (raising ValueError) or has made `limit`
+    # steps in total (returning False).
+
+    def _run_interpreted(self, limit=None):
+        if limit is None:
+            limit = sys.maxsize
         while self.state not in self.accepting_states:
+            if self.steps >= limit:
+                return False
             self.step()
+        return True
 
-        self.logger.info("machine stopped in state {}".format(self.state))
+    def _run_traced(self, tracer, limit=None):
+        # tracing needs the names of states and symbols on every step, so it
+        # always runs on the interpreter
+        if limit is None:
+            limit = sys.maxsize
+        try:
+            while self.state not in self.accepting_states:
+                if self.steps >= limit:
+                    return False
+                rchar, transition = self.step()
+                tracer.on_step(self, rchar, transition)
+        except ValueError as err:
+            tracer.on_error(self, err)
+            raise
+        tracer.on_halt(self)
+        return True
+
+    def _run_compiled(self, limit=None):
+        if len(self.tape.symbols) != self._nsymbols:
+            # symbols have been written to the tape from outside
+            self.compile()
+
+        tape = self.tape
+        table = self._table
+        halting = self._halting
+        nsymbols = self._nsymbols
+
+        row = self._state_codes[self.state] * nsymbols
+        index = tape.reserve(tape.pos)
+        cells = tape.cells
+        size = len(cells)
+        steps = 0
+        if limit is None:
+            budget = sys.maxsize
+        else:
+            budget = limit - self.steps
+        transition = ()
+        try:
+            while steps < budget and not halting[row]:
+                transition = table[row + cells[index]]
+                if transition is None:
+                    break
+                cells[index], move, row = transition
+                index += move
+                steps += 1
+                if not 0 <= index < size:
+                    index = tape.reserve(index - tape.offset)
+                    cells = tape.cells
+                    size = len(cells)
+        finally:
+            tape.pos = index - tape.offset
+            self.steps += steps
+            self.state = self._state_names[row // nsymbols]
+
+        if transition is None:
+            raise ValueError("no transition found from current state")
+        return halting[row]
+
+    def _run_profiled(self, profile, limit=None):
+        if len(self.tape.symbols) != self._nsymbols:
+            self.compile()
+        profile._attach(self)
+        started = time.perf_counter()
+
+        tape = self.tape
+        table = self._table
+        halting = self._halting
+        nsymbols = self._nsymbols
+        hits = profile.hits
+
+        row = self._state_codes[self.state] * nsymbols
+        index = tape.reserve(tape.pos)
+        cells = tape.cells
+        size = len(cells)
+        if profile.low is None:
+            lo = hi = index
+        else:
+            lo = profile.low + tape.offset
+            hi = profile.high + tape.offset
+        steps = 0
+        if limit is None:
+            budget = sys.maxsize
+        else:
+            budget = limit - self.steps
+        transition = ()
+        try:
+            while steps < budget and not halting[row]:
+                key = row + cells[index]
+                transition = table[key]
+                if transition is None:
+                    break
+                hits[key] += 1
+                cells[index], move, row = transition
+                index += move
+                steps += 1
+                if index < lo:
+                    lo = index
+                elif index > hi:
+                    hi = index
+                if not 0 <= index < size:
+                    offset = tape.offset
+                    index = tape.reserve(index - offset)
+                    lo += tape.offset - offset
+                    hi += tape.offset - offset
+                    cells = tape.cells
+                    size = len(cells)
+        finally:
+            tape.pos = index - tape.offset
+            self.steps += steps
+            self.state = self._state_names[row // nsymbols]
+            profile.steps += steps
+            profile.low = lo - tape.offset
+            profile.high = hi - tape.offset
+            profile.seconds += time.perf_counter() - started
+
+        if transition is None:
+            raise ValueError("no transition found from current state")
+        return halting[row]
 
     def step(self):
+        rchar = self.tape.read()
         try:
-            transition = self.transitions[self.state][self.tape.read()]
+            transition = self.transitions[self.state][rchar]
         except KeyError:
             raise ValueError("no transition found from current state") \
                 from None
@@ -105,13 +716,173 @@ class TuringMachine:
         self.tape.write(transition.wchar)
         self.state = transition.new_state
         self.tape.move(transition.move_head)
+        self.steps += 1
 
-        self.logger.info("step done. current state: {} {}".format(
-            self.state, self.tape))
+        return rchar, transition
+
+    def iter_steps(self, every=1, window=16):
+        # Runs the machine, yielding a StepView of the initial configuration,
+        # of every `every`th step and of the final one. The view's cells are
+        # a memoryview of the codes (indices into tape.symbols) of the
+        # `window` cells around the head, starting at logical position
+        # `start`. They are released when the generator resumes or is
+        # closed; copy them (bytes(view.cells)) to keep them. They view a
+        # copy of the window, so the tape can grow while they are held, e.g.
+        # when the machine is run again after abandoning the generator.
+        if every < 1 or window < 1:
+            raise ValueError("every and window need to be positive")
+        if self.tracer is not None:
+            advance = functools.partial(self._run_traced, self.tracer)
+        else:
+            advance = self._run_compiled
+
+        tape = self.tape
+        halted = self.state in self.accepting_states
+        while True:
+            start = tape.pos - window // 2
+            tape.reserve(start + window - 1)
+            first = tape.reserve(start)
+            view = memoryview(tape.cells[first:first+window])
+            try:
+                yield StepView(self.steps, self.state, tape.pos, start, view)
+            finally:
+                view.release()
+            if halted:
+                return
+            halted = advance(self.steps + every - self.steps % every)
 
     def output(self):
         return self.tape.read_vars(self.outputs)
 
+    def output_runs(self):
+        return self.tape.read_runs(self.outputs)
+
+    def _snapshot(self):
+        # the contents of a checkpoint, copied from the machine
+        tape = self.tape
+        symbols = tape.symbols
+        states = {}
+
+        def intern(state):
+            return states.setdefault(state, len(states))
+
+        intern(self.state)
+        transitions = array.array("i")
+        for state, row in self.transitions.items():
+            for rchar, transition in row.items():
+                transitions.extend((intern(state),
+                                    tape.codes[rchar],
+                                    tape.codes[transition.wchar],
+                                    transition.move_head,
+                                    intern(transition.new_state)))
+        for state in self.accepting_states:
+            intern(state)
+
+        extent = tape.extent()
+        if extent is None:
+            low = high = tape.pos
+        else:
+            low = min(extent[0], tape.pos)
+            high = max(extent[1], tape.pos)
+        # reserve replaces the buffer when growing it to the left, so both ends
+        # are reserved before the buffer is sliced
+        tape.reserve(low)
+        tape.reserve(high)
+        cells = tape.cells[low+tape.offset:high+tape.offset+1]
+
+        header = json.dumps({
+            "byteorder": sys.byteorder,
+            "blank": tape.blank,
+            "symbols": symbols,
+            "states": list(states),
+            "accepting": [states[state] for state in self.accepting_states],
+            "outputs": self.outputs,
+            "state": states[self.state],
+            "steps": self.steps,
+            "pos": tape.pos,
+            "low": low,
+            "transitions": len(transitions) // 5,
+            "typecode": cells.typecode,
+        }).encode("utf-8")
+        header += b" " * (-(_checkpoint_prefix.size + len(header)) % 4)
+        return (_checkpoint_prefix.pack(CHECKPOINT_MAGIC, len(header)),
+                header,
+                transitions.tobytes(),
+                cells.tobytes())
+
+    def checkpoint(self, path, background=False):
+        # Writes a snapshot of the machine to path, replacing it atomically.
+        # With background, the snapshot is written by a new thread, which is
+        # returned.
+        snapshot = self._snapshot()
+
+        def write():
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp, "wb") as f:
+                for part in snapshot:
+                    f.write(part)
+            os.replace(tmp, path)
+
+        if not background:
+            write()
+            return None
+        writer = threading.Thread(target=write, name="checkpoint")
+        writer.start()
+        return writer
+
+    @classmethod
+    def restore(cls, path, tracer=None):
+        # the machine as written by checkpoint
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, header_size = _checkpoint_prefix.unpack_from(data)
+        if magic != CHECKPOINT_MAGIC:
+            raise ValueError("not a checkpoint: {}".format(path))
+        start = _checkpoint_prefix.size + header_size
+        header = json.loads(data[_checkpoint_prefix.size:start].decode(
+            "utf-8"))
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError("checkpoint was written on another byte order")
+
+        states = header["states"]
+        symbols = header["symbols"]
+        quintuples = array.array("i")
+        end = start + 5 * quintuples.itemsize * header["transitions"]
+        quintuples.frombytes(data[start:end])
+        cells = array.array(header["typecode"])
+        cells.frombytes(data[end:])
+
+        machine = cls(
+            [],
+            [(states[quintuples[i]],
+              symbols[quintuples[i+1]],
+              symbols[quintuples[i+2]],
+              quintuples[i+3],
+              states[quintuples[i+4]])
+             for i in range(0, len(quintuples), 5)],
+            states[header["state"]],
+            {states[state] for state in header["accepting"]},
+            blank=header["blank"],
+            outputs=header["outputs"],
+            tracer=tracer)
+
+        # the codes of the restored tape need not be the ones of the
+        # checkpoint's tape, as its symbols might have been interned in
+        # another order
+        tape = machine.tape
+        codes = [tape.intern(char) for char in symbols]
+        if codes != list(range(len(symbols))):
+            cells = array.array(tape.cells.typecode,
+                                (codes[code] for code in cells))
+        elif cells.typecode != tape.cells.typecode:
+            cells = array.array(tape.cells.typecode, cells)
+        tape.cells = cells
+        tape.offset = -header["low"]
+        tape.pos = header["pos"]
+        machine.steps = header["steps"]
+        machine.compile()
+        return machine
+
     @property
     def state(self):
         return self._state
@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 # encoding=utf-8
 import abc
-import collections
+import functools
 import logging
 import re
 import operator
@@ -15,11 +15,144 @@ syntax_end = re.compile(r"^END$")
 syntax_comment = re.compile(r"#.*$")
 syntax_add_assignment = re.compile(
     r"^x_?([0-9]+)\s*:=\s*x_?([0-9]+)\s*([+-])\s*x_?([0-9]+)$")
+syntax_procedure = re.compile(
+    r"^PROC\s+([A-Za-z_][A-Za-z0-9_]*)\s*\(([^)]*)\)\s+DO$")
+syntax_call = re.compile(
+    r"^x_?([0-9]+)\s*:=\s*([A-Za-z_][A-Za-z0-9_]*)\s*\(([^)]*)\)$")
+syntax_register_list = re.compile(
+    r"^\s*(x_?[0-9]+(\s*,\s*x_?[0-9]+)*)?\s*$")
+
+# instructions of the bytecode, see Bytecode
+(CONST, ADD_CONST, SUB_CONST, ADD, SUB,
+ LOOP_INIT, LOOP_NEXT, JUMP_ZERO, JUMP, CALL) = range(10)
+
+opcode_names = ["CONST", "ADD_CONST", "SUB_CONST", "ADD", "SUB",
+                "LOOP_INIT", "LOOP_NEXT", "JUMP_ZERO", "JUMP", "CALL"]
+
+# Compiled procedures remember the results of up to memo_size argument
+# tuples each; 0 disables the memo.
+memo_size = 0
+
+def parse_registers(text):
+    # the indices of a comma separated list of registers
+    if not syntax_register_list.match(text):
+        return None
+    return [int(item.strip().lstrip("x_")) for item in text.split(",")
+            if item.strip()]
+
+# Compiled LOOPs whose bodies are affine in the registers run in closed form
+# once they have at least accelerate_threshold iterations, see Loop.summarize.
+accelerate = True
+accelerate_threshold = 16
+
+# Affine expressions over the registers at the start of a LOOP body are
+# (constant, {register: coefficient}).
+
+def _affine_read(state, index):
+    return state.get(index, (0, {index: 1}))
+
+def _affine_add(a, b, factor=1):
+    # a + factor * b
+    coeffs = dict(a[1])
+    for index, coeff in b[1].items():
+        coeffs[index] = coeffs.get(index, 0) + factor * coeff
+    return a[0] + factor * b[0], coeffs
+
+def _affine_eval(expr, values):
+    const, coeffs = expr
+    return const + sum(coeff * values[index]
+                       for index, coeff in coeffs.items())
+
+def _mat_vec(matrix, vector):
+    return [sum(a * b for a, b in zip(row, vector)) for row in matrix]
+
+def _mat_mul(a, b):
+    columns = list(zip(*b))
+    return [[sum(x * y for x, y in zip(row, column)) for column in columns]
+            for row in a]
+
+def _mat_pow_vec(matrix, n, vector):
+    # matrix**n * vector by repeated squaring
+    while n:
+        if n & 1:
+            vector = _mat_vec(matrix, vector)
+        n >>= 1
+        if n:
+            matrix = _mat_mul(matrix, matrix)
+    return vector
+
+def _accelerated_loop(varindex, summary, body):
+    # The closed form of a LOOP with the given summary. The registers are
+    # a vector with an extra 1 for the constants, and one iteration is a
+    # matrix with non-negative coefficients, except for the constants.
+    state, checks = summary
+    registers = set(state)
+    for const, coeffs in list(state.values()) + checks:
+        registers.update(coeffs)
+    registers = sorted(registers)
+    position = {index: i for i, index in enumerate(registers)}
+    size = len(registers) + 1
+
+    matrix = []
+    for index in registers:
+        const, coeffs = _affine_read(state, index)
+        row = [0] * size
+        for source, coeff in coeffs.items():
+            row[position[source]] = coeff
+        row[-1] = const
+        matrix.append(row)
+    matrix.append([0] * (size - 1) + [1])
+
+    def exact(values):
+        # whether no monus of the body clamps in an iteration from values
+        return all(_affine_eval(check, values) >= 0 for check in checks)
+
+    def run(regs):
+        n = regs[varindex]
+        if n < max(accelerate_threshold, 1):
+            for i in range(n):
+                body(regs)
+            return
+
+        values = {index: regs[index] for index in registers}
+        vector = [regs[index] for index in registers] + [1]
+        if checks:
+            # As the coefficients are non-negative, each iteration changes
+            # the registers in the same direction as the first one does,
+            # unless a monus clamps. So if the registers grow, no monus
+            # clamps if it does not in the first iteration, and if they
+            # shrink, none clamps if it does not in the last iteration.
+            if not exact(values):
+                vector = None
+            else:
+                after = _mat_vec(matrix, vector)
+                if all(a >= b for a, b in zip(after, vector)):
+                    vector = _mat_pow_vec(matrix, n, vector)
+                elif all(a <= b for a, b in zip(after, vector)):
+                    vector = _mat_pow_vec(matrix, n - 1, vector)
+                    if exact(dict(zip(registers, vector))):
+                        vector = _mat_vec(matrix, vector)
+                    else:
+                        vector = None
+                else:
+                    vector = None
+            if vector is None:
+                for i in range(n):
+                    body(regs)
+                return
+        else:
+            vector = _mat_pow_vec(matrix, n, vector)
+
+        for index, value in zip(registers, vector):
+            regs[index] = value
+    return run
 
 class VM(object):
-    def __init__(self, *args):
+    def __init__(self, *args, size=0):
+        # size is the number of registers, i.e. the highest x_i index of the
+        # program plus one
         self._logger = logging.getLogger(type(self).__name__)
-        self._data = collections.defaultdict(int)
+        self._data = [0] * max(size, len(args) + 1)
         for i, arg in enumerate(args):
             self.set(i+1, max(int(arg), 0))
 
@@ -39,6 +172,41 @@ class Node(object):
     def run(self, vm):
         pass
 
+    @abc.abstractmethod
+    def compile(self):
+        # returns a function which executes the node on a list of registers
+        pass
+
+    @abc.abstractmethod
+    def highest_register(self):
+        pass
+
+    @abc.abstractmethod
+    def reads(self):
+        # the registers the node (or its body) reads
+        pass
+
+    @abc.abstractmethod
+    def writes(self):
+        # the registers the node (or its body) assigns
+        pass
+
+    @abc.abstractmethod
+    def summarize(self, state, checks):
+        # Applies the effect of the node to state, mapping registers to
+        # their affine expressions, and appends the expressions which a
+        # monus requires to be non-negative to checks. Returns False if the
+        # effect is not affine.
+        pass
+
+    @abc.abstractmethod
+    def assemble(self, code, depth):
+        # Appends the instruction(s) of the node to code. Nodes with a body
+        # return the index of the instruction to patch with the end of the
+        # body, see BodyNode.assemble_end. depth is the number of LOOPs
+        # around the node.
+        pass
+
     @abc.abstractmethod
     def to_string(self, indent=""):
         pass
@@ -55,13 +223,85 @@ class BodyNode(Node):
         for stmt in self.body:
             stmt.run(vm)
 
+    def compile(self):
+        stmts = tuple(stmt.compile() for stmt in self.body)
+        if not stmts:
+            def run(regs):
+                pass
+        elif len(stmts) == 1:
+            run, = stmts
+        else:
+            def run(regs):
+                for stmt in stmts:
+                    stmt(regs)
+        return run
+
+    def highest_register(self):
+        return max((stmt.highest_register() for stmt in self.body),
+                   default=0)
+
+    def reads(self):
+        return set().union(*(stmt.reads() for stmt in self.body))
+
+    def writes(self):
+        return set().union(*(stmt.writes() for stmt in self.body))
+
+    def assemble_end(self, code, head):
+        # closes the body opened by assemble
+        pass
+
+    def summarize(self, state, checks):
+        return all(stmt.summarize(state, checks) for stmt in self.body)
+
+    def opening(self):
+        # the line opening the body, or None
+        return None
+
     def to_string(self, indent=""):
-        return "\n".join(
-            stmt.to_string(indent=indent)
-            for stmt in self.body)
+        # without recursion, as programs may nest deeper than Python allows
+        lines = []
+        opening = self.opening()
+        if opening is not None:
+            lines.append(indent + opening)
+            indent += "    "
+        if not self.body:
+            lines.append("")
+        stack = [(iter(self.body), indent)]
+        while stack:
+            stmts, indent = stack[-1]
+            stmt = next(stmts, None)
+            if stmt is None:
+                stack.pop()
+                if stack or opening is not None:
+                    lines.append(indent[:-4] + "END")
+            elif isinstance(stmt, BodyNode):
+                lines.append(indent + stmt.opening())
+                if not stmt.body:
+                    lines.append("")
+                stack.append((iter(stmt.body), indent + "    "))
+            else:
+                lines.append(stmt.to_string(indent=indent))
+        return "\n".join(lines)
 
 class Program(BodyNode):
-    pass
+    def __init__(self):
+        super(Program, self).__init__()
+        self.procedures = {}
+
+    def to_string(self, indent=""):
+        return "\n".join(
+            [procedure.to_string(indent=indent)
+             for procedure in self.procedures.values()] +
+            [super(Program, self).to_string(indent=indent)])
+
+    def run_compiled(self, *args):
+        # runs the compiled program on fresh registers holding the arguments,
+        # returning x0
+        regs = [0] * (max(self.highest_register(), len(args)) + 1)
+        for i, arg in enumerate(args):
+            regs[i+1] = max(int(arg), 0)
+        self.compile()(regs)
+        return regs[0]
 
 class Loop(BodyNode):
     @classmethod
@@ -88,13 +328,66 @@ class Loop(BodyNode):
             super(Loop, self).run(vm)
         self._logger.debug("END LOOP x{n}".format(n=self._varindex))
 
-    def to_string(self, indent=""):
-        return """{indent}LOOP x{} DO
-{}
-{indent}END""".format(
-    self._varindex,
-    super(Loop, self).to_string(indent=indent+"    "),
-    indent=indent)
+    def compile(self):
+        body = super(Loop, self).compile()
+        varindex = self._varindex
+        summary = self.summary() if accelerate else None
+        if summary is not None:
+            if not summary[0]:
+                # nothing is assigned
+                def run(regs):
+                    pass
+                return run
+            return _accelerated_loop(varindex, summary, body)
+
+        def run(regs):
+            for i in range(regs[varindex]):
+                body(regs)
+        return run
+
+    def summary(self):
+        # The affine effect of one iteration of the body and the monus
+        # arguments which are not non-negative by construction, or None.
+        state = {}
+        checks = []
+        if not super(Loop, self).summarize(state, checks):
+            return None
+        return state, [check for check in checks if check[0] < 0]
+
+    def summarize(self, state, checks):
+        # The whole LOOP is affine if its body only adds constants to
+        # registers: then it adds the count times the constants.
+        summary = self.summary()
+        if summary is None or summary[1]:
+            return False
+        increments = {}
+        for index, (const, coeffs) in summary[0].items():
+            if coeffs != {index: 1}:
+                return False
+            increments[index] = const
+        count = _affine_read(state, self._varindex)
+        for index, const in increments.items():
+            state[index] = _affine_add(_affine_read(state, index), count,
+                                       const)
+        return True
+
+    def highest_register(self):
+        return max(self._varindex, super(Loop, self).highest_register())
+
+    def reads(self):
+        return super(Loop, self).reads() | {self._varindex}
+
+    def assemble(self, code, depth):
+        code.append((LOOP_INIT, depth, self._varindex, 0))
+        code.append((LOOP_NEXT, depth, None, 0))
+        return len(code) - 1
+
+    def assemble_end(self, code, head):
+        code.append((JUMP, head, 0, 0))
+        code[head] = code[head][:2] + (len(code), 0)
+
+    def opening(self):
+        return "LOOP x{} DO".format(self._varindex)
 
 class While(BodyNode):
     @classmethod
@@ -125,13 +418,34 @@ class While(BodyNode):
             n=self._varindex,
             v=currv))
 
-    def to_string(self, indent=""):
-        return """{indent}WHILE x{}≠0 DO
-{}
-{indent}END""".format(
-    self._varindex,
-    super(While, self).to_string(indent=indent+"    "),
-    indent=indent)
+    def compile(self):
+        body = super(While, self).compile()
+        varindex = self._varindex
+
+        def run(regs):
+            while regs[varindex]:
+                body(regs)
+        return run
+
+    def highest_register(self):
+        return max(self._varindex, super(While, self).highest_register())
+
+    def reads(self):
+        return super(While, self).reads() | {self._varindex}
+
+    def summarize(self, state, checks):
+        return False
+
+    def assemble(self, code, depth):
+        code.append((JUMP_ZERO, self._varindex, None, 0))
+        return len(code) - 1
+
+    def assemble_end(self, code, head):
+        code.append((JUMP, head, 0, 0))
+        code[head] = code[head][:2] + (len(code), 0)
+
+    def opening(self):
+        return "WHILE x{}≠0 DO".format(self._varindex)
 
 class VarAssignment(Node):
     @classmethod
@@ -171,6 +485,44 @@ class VarAssignment(Node):
             new_value)
         vm.set(self._destindex, new_value)
 
+    def compile(self):
+        dest = self._destindex
+        src = self._srcindex
+        offset = self._offset
+        if offset >= 0:
+            def run(regs):
+                regs[dest] = regs[src] + offset
+        else:
+            def run(regs):
+                value = regs[src] + offset
+                regs[dest] = value if value > 0 else 0
+        return run
+
+    def highest_register(self):
+        return max(self._destindex, self._srcindex)
+
+    def reads(self):
+        return {self._srcindex}
+
+    def writes(self):
+        return {self._destindex}
+
+    def summarize(self, state, checks):
+        expr = _affine_add(_affine_read(state, self._srcindex),
+                           (self._offset, {}))
+        if self._offset < 0:
+            checks.append(expr)
+        state[self._destindex] = expr
+        return True
+
+    def assemble(self, code, depth):
+        if self._offset >= 0:
+            code.append((ADD_CONST, self._destindex, self._srcindex,
+                         self._offset))
+        else:
+            code.append((SUB_CONST, self._destindex, self._srcindex,
+                         -self._offset))
+
     def to_string(self, indent=""):
         return indent+"x{} := x{} {} {}".format(
             self._destindex,
@@ -219,6 +571,41 @@ class AddAssignment(Node):
             new_value)
         vm.set(self._destindex, new_value)
 
+    def compile(self):
+        dest = self._destindex
+        src1 = self._src1index
+        src2 = self._src2index
+        if self._op == '-':
+            def run(regs):
+                value = regs[src1] - regs[src2]
+                regs[dest] = value if value > 0 else 0
+        else:
+            def run(regs):
+                regs[dest] = regs[src1] + regs[src2]
+        return run
+
+    def highest_register(self):
+        return max(self._destindex, self._src1index, self._src2index)
+
+    def reads(self):
+        return {self._src1index, self._src2index}
+
+    def writes(self):
+        return {self._destindex}
+
+    def summarize(self, state, checks):
+        # a register subtrahend would make coefficients negative
+        if self._op == '-':
+            return False
+        state[self._destindex] = _affine_add(
+            _affine_read(state, self._src1index),
+            _affine_read(state, self._src2index))
+        return True
+
+    def assemble(self, code, depth):
+        code.append((SUB if self._op == '-' else ADD, self._destindex,
+                     self._src1index, self._src2index))
+
     def to_string(self, indent=""):
         return indent+"x{} := x{} {} x{}".format(
             self._destindex,
@@ -251,12 +638,543 @@ class ConstAssignment(Node):
             self._value)
         vm.set(self._destindex, self._value)
 
+    def compile(self):
+        dest = self._destindex
+        value = self._value
+
+        def run(regs):
+            regs[dest] = value
+        return run
+
+    def highest_register(self):
+        return self._destindex
+
+    def reads(self):
+        return set()
+
+    def writes(self):
+        return {self._destindex}
+
+    def summarize(self, state, checks):
+        state[self._destindex] = (self._value, {})
+        return True
+
+    def assemble(self, code, depth):
+        code.append((CONST, self._destindex, self._value, 0))
+
     def to_string(self, indent=""):
         return indent+"x{} := {}".format(
             self._destindex,
             self._value)
 
-def parse(s, whilep=False, add_assignment=False):
+class Procedure(BodyNode):
+    # A named subprogram. Each call runs it on fresh registers, with the
+    # arguments in the parameter registers, and returns its x0; so it has
+    # no effect besides its result.
+
+    @classmethod
+    def parse(cls, line):
+        m = syntax_procedure.match(line)
+        if not m:
+            return None
+
+        params = parse_registers(m.group(2))
+        if params is None or len(set(params)) != len(params):
+            raise ValueError("Invalid parameters: {}".format(line))
+        return cls(m.group(1), params)
+
+    def __init__(self, name, params):
+        super(Procedure, self).__init__()
+        self.name = name
+        self.params = params
+        self._compiled = None
+        self._assembled = None
+
+    def may_diverge(self):
+        # whether a call might not return: a WHILE could loop forever
+        stack = list(self.body)
+        while stack:
+            stmt = stack.pop()
+            if isinstance(stmt, While) or (
+                    isinstance(stmt, CallAssignment) and
+                    stmt._procedure.may_diverge()):
+                return True
+            if isinstance(stmt, BodyNode):
+                stack.extend(stmt.body)
+        return False
+
+    def highest_register(self):
+        return max([super(Procedure, self).highest_register()] +
+                   self.params)
+
+    def call(self, *args):
+        # runs the procedure on the tree walker
+        vm = VM(size=self.highest_register() + 1)
+        for param, arg in zip(self.params, args):
+            vm.set(param, arg)
+        self.run(vm)
+        return vm.get(0)
+
+    def _memoized(self, function):
+        function.__name__ = self.name
+        if memo_size:
+            function = functools.lru_cache(maxsize=memo_size)(function)
+        return function
+
+    def compiled(self):
+        # the procedure compiled to a function of the arguments, once
+        if self._compiled is None:
+            body = self.compile()
+            size = self.highest_register() + 1
+            params = self.params
+
+            def call(*args):
+                regs = [0] * size
+                for param, arg in zip(params, args):
+                    regs[param] = arg
+                body(regs)
+                return regs[0]
+            self._compiled = self._memoized(call)
+        return self._compiled
+
+    def assembled(self):
+        # the procedure as bytecode, as a function of the arguments, once
+        if self._assembled is None:
+            bytecode = Bytecode(self, self.params)
+
+            def call(*args):
+                return bytecode.run(*args)
+            self._assembled = self._memoized(call)
+        return self._assembled
+
+    def memo_stats(self):
+        # (hits, misses, cached results) of the memos in use
+        hits = misses = size = 0
+        for function in (self._compiled, self._assembled):
+            if hasattr(function, "cache_info"):
+                info = function.cache_info()
+                hits += info.hits
+                misses += info.misses
+                size += info.currsize
+        return hits, misses, size
+
+    def opening(self):
+        return "PROC {}({}) DO".format(
+            self.name,
+            ", ".join("x{}".format(param) for param in self.params))
+
+class CallAssignment(Node):
+    @classmethod
+    def parse(cls, line, procedures):
+        m = syntax_call.match(line)
+        if not m:
+            return None
+
+        args = parse_registers(m.group(3))
+        if args is None:
+            return None
+        try:
+            procedure = procedures[m.group(2)]
+        except KeyError:
+            raise ValueError("Unknown procedure: {}".format(line)) from None
+        if len(args) != len(procedure.params):
+            raise ValueError("{} expects {} argument(s): {}".format(
+                procedure.name, len(procedure.params), line))
+
+        return cls(int(m.group(1)), procedure, args)
+
+    def __init__(self, destindex, procedure, argindices):
+        super(CallAssignment, self).__init__()
+        self._destindex = destindex
+        self._procedure = procedure
+        self._argindices = argindices
+        # the arguments are formatted by the logger, only if it is enabled
+        self._message = "x%d := %s({})  # x%d := %d".format(
+            ", ".join(["%d"] * len(argindices)))
+
+    def run(self, vm):
+        args = [vm.get(index) for index in self._argindices]
+        new_value = self._procedure.call(*args)
+        self._logger.debug(
+            self._message,
+            self._destindex,
+            self._procedure.name,
+            *args,
+            self._destindex,
+            new_value)
+        vm.set(self._destindex, new_value)
+
+    def compile(self):
+        dest = self._destindex
+        args = tuple(self._argindices)
+        call = self._procedure.compiled()
+
+        def run(regs):
+            regs[dest] = call(*[regs[index] for index in args])
+        return run
+
+    def highest_register(self):
+        return max([self._destindex] + self._argindices)
+
+    def reads(self):
+        return set(self._argindices)
+
+    def writes(self):
+        return {self._destindex}
+
+    def summarize(self, state, checks):
+        return False
+
+    def assemble(self, code, depth):
+        code.append((CALL, self._destindex, self._procedure.assembled(),
+                     tuple(self._argindices)))
+
+    def to_string(self, indent=""):
+        return indent+"x{} := {}({})".format(
+            self._destindex,
+            self._procedure.name,
+            ", ".join("x{}".format(index) for index in self._argindices))
+
+class Bytecode(object):
+    # A program as a flat list of (opcode, a, b, c) instructions:
+    #
+    #     CONST d v         x_d := v
+    #     ADD_CONST d s k   x_d := x_s + k
+    #     SUB_CONST d s k   x_d := x_s - k, clamped at 0
+    #     ADD d s t         x_d := x_s + x_t
+    #     SUB d s t         x_d := x_s - x_t, clamped at 0
+    #     LOOP_INIT n s     counter_n := x_s
+    #     LOOP_NEXT n end   if counter_n = 0 jump to end, else decrement it
+    #     JUMP_ZERO s end   if x_s = 0 jump to end
+    #     JUMP target
+    #     CALL d f args     x_d := f(x_a for a in args)
+    #
+    # LOOPs nested n deep count with counter n. The program is assembled
+    # without recursion, so its nesting depth is not limited.
+
+    def __init__(self, program, params=None):
+        # params are the registers of the arguments, by default x1, x2, ...
+        code = []
+        registers = 1 + max(params or [0])
+        counters = 0
+        # (node, its remaining statements, instruction to patch at its end,
+        # LOOPs around its statements)
+        stack = [(program, iter(program.body), None, 0)]
+        while stack:
+            node, stmts, head, depth = stack[-1]
+            stmt = next(stmts, None)
+            if stmt is None:
+                stack.pop()
+                node.assemble_end(code, head)
+                continue
+
+            start = len(code)
+            head = stmt.assemble(code, depth)
+            for op, a, b, c in code[start:]:
+                if op in (CONST, JUMP_ZERO):
+                    registers = max(registers, a + 1)
+                elif op == LOOP_INIT:
+                    registers = max(registers, b + 1)
+                    counters = max(counters, a + 1)
+                elif op == CALL:
+                    registers = max([registers, a + 1] +
+                                    [index + 1 for index in c])
+                elif op != LOOP_NEXT:
+                    registers = max(registers, a + 1, b + 1,
+                                    c + 1 if op in (ADD, SUB) else 0)
+            if isinstance(stmt, BodyNode):
+                stack.append((stmt, iter(stmt.body), head,
+                              depth + isinstance(stmt, Loop)))
+
+        self.code = code
+        self.registers = registers
+        self.counters = counters
+        self.params = params
+
+    def __str__(self):
+        return "\n".join(
+            "{:4d} {:<9} {} {} {}".format(
+                pc, opcode_names[op], a,
+                b.__name__ if op == CALL else b,
+                " ".join("x{}".format(index) for index in c)
+                if op == CALL else c)
+            for pc, (op, a, b, c) in enumerate(self.code))
+
+    def run(self, *args):
+        # runs the program on fresh registers holding the arguments,
+        # returning x0
+        regs = [0] * max(self.registers, len(args) + 1)
+        if self.params is None:
+            for i, arg in enumerate(args):
+                regs[i+1] = max(int(arg), 0)
+        else:
+            for param, arg in zip(self.params, args):
+                regs[param] = arg
+        counters = [0] * self.counters
+
+        code = self.code
+        end = len(code)
+        pc = 0
+        while pc < end:
+            op, a, b, c = code[pc]
+            pc += 1
+            if op == ADD_CONST:
+                regs[a] = regs[b] + c
+            elif op == LOOP_NEXT:
+                if counters[a]:
+                    counters[a] -= 1
+                else:
+                    pc = b
+            elif op == JUMP:
+                pc = a
+            elif op == SUB_CONST:
+                value = regs[b] - c
+                regs[a] = value if value > 0 else 0
+            elif op == ADD:
+                regs[a] = regs[b] + regs[c]
+            elif op == SUB:
+                value = regs[b] - regs[c]
+                regs[a] = value if value > 0 else 0
+            elif op == CONST:
+                regs[a] = b
+            elif op == JUMP_ZERO:
+                if not regs[a]:
+                    pc = b
+            elif op == CALL:
+                regs[a] = b(*[regs[index] for index in c])
+            else:
+                counters[a] = regs[b]
+        return regs[0]
+
+# Optimizer passes. Each rewrites the statements of a body in place and
+# keeps the value of x0 at the end of the program; see optimize.
+
+def _propagate_constants(body, known):
+    # known maps registers to their values before the statements, if they
+    # are known; it is updated to after them
+    ret = []
+    for stmt in body:
+        if isinstance(stmt, BodyNode):
+            if known.get(stmt._varindex) == 0:
+                # the body never runs
+                continue
+            # only the registers the body leaves alone are known in it and
+            # after it
+            for index in stmt.writes():
+                known.pop(index, None)
+            _propagate_constants(stmt.body, dict(known))
+        else:
+            if isinstance(stmt, VarAssignment) and \
+                    stmt._srcindex in known:
+                stmt = ConstAssignment(
+                    stmt._destindex,
+                    max(known[stmt._srcindex] + stmt._offset, 0))
+            elif isinstance(stmt, AddAssignment):
+                src1 = known.get(stmt._src1index)
+                src2 = known.get(stmt._src2index)
+                if src1 is not None and src2 is not None:
+                    stmt = ConstAssignment(
+                        stmt._destindex,
+                        max(src1 - src2 if stmt._op == '-' else src1 + src2,
+                            0))
+                elif src2 is not None:
+                    stmt = VarAssignment(
+                        stmt._destindex, stmt._src1index,
+                        -src2 if stmt._op == '-' else src2)
+                elif src1 is not None and stmt._op == '+':
+                    stmt = VarAssignment(
+                        stmt._destindex, stmt._src2index, src1)
+            if isinstance(stmt, ConstAssignment):
+                known[stmt._destindex] = stmt._value
+            else:
+                known.pop(stmt._destindex, None)
+        ret.append(stmt)
+    body[:] = ret
+
+def _forget_copies(copies, indices):
+    for dest, src in list(copies.items()):
+        if dest in indices or src in indices:
+            del copies[dest]
+
+def _propagate_copies(body, copies):
+    # copies maps registers to registers holding the same value before the
+    # statements; it is updated to after them
+    for i, stmt in enumerate(body):
+        if isinstance(stmt, BodyNode):
+            # only the copies the body leaves alone hold in it and after it
+            _forget_copies(copies, stmt.writes())
+            stmt._varindex = copies.get(stmt._varindex, stmt._varindex)
+            _propagate_copies(stmt.body, dict(copies))
+            continue
+
+        if isinstance(stmt, VarAssignment):
+            stmt = VarAssignment(
+                stmt._destindex,
+                copies.get(stmt._srcindex, stmt._srcindex),
+                stmt._offset)
+        elif isinstance(stmt, CallAssignment):
+            stmt = CallAssignment(
+                stmt._destindex,
+                stmt._procedure,
+                [copies.get(index, index) for index in stmt._argindices])
+        elif isinstance(stmt, AddAssignment):
+            stmt = AddAssignment(
+                stmt._destindex,
+                copies.get(stmt._src1index, stmt._src1index),
+                stmt._op,
+                copies.get(stmt._src2index, stmt._src2index))
+        body[i] = stmt
+        _forget_copies(copies, {stmt._destindex})
+        if isinstance(stmt, VarAssignment) and stmt._offset == 0 and \
+                stmt._srcindex != stmt._destindex:
+            copies[stmt._destindex] = stmt._srcindex
+
+def _loop_end_liveness(stmt, live):
+    # the registers live at the end of the body of a LOOP or WHILE after
+    # which live are: those live after it or at the start of the body,
+    # and the WHILE's condition
+    end = set(live)
+    if isinstance(stmt, While):
+        end.add(stmt._varindex)
+    while True:
+        start = _liveness(stmt.body, end, False)
+        if start <= end:
+            return end
+        end |= start
+
+def _liveness(body, live, remove):
+    # the registers live before the statements given those live after
+    # them; with remove, the assignments to dead registers are removed
+    live = set(live)
+    ret = []
+    for stmt in reversed(body):
+        if isinstance(stmt, BodyNode):
+            end = _loop_end_liveness(stmt, live)
+            live |= _liveness(stmt.body, end, remove)
+            live.add(stmt._varindex)
+        elif (stmt._destindex not in live or (
+                isinstance(stmt, VarAssignment) and stmt._offset == 0 and
+                stmt._srcindex == stmt._destindex)) and \
+                not _may_diverge(stmt):
+            if remove:
+                continue
+        else:
+            live.discard(stmt._destindex)
+            live |= stmt.reads()
+        ret.append(stmt)
+    if remove:
+        body[:] = reversed(ret)
+    return live
+
+def _may_diverge(stmt):
+    # calls which might not return must neither be removed nor hoisted
+    return isinstance(stmt, CallAssignment) and \
+        stmt._procedure.may_diverge()
+
+def _remove_empty_loops(body):
+    # WHILEs with an empty body stay, as they might not terminate
+    ret = []
+    for stmt in body:
+        if isinstance(stmt, BodyNode):
+            _remove_empty_loops(stmt.body)
+            if isinstance(stmt, Loop) and not stmt.body:
+                continue
+        ret.append(stmt)
+    body[:] = ret
+
+def _hoist_invariants(body, live):
+    # Moves assignments which compute the same value in every iteration
+    # out of LOOP bodies. As the LOOP might not run at all, the assigned
+    # register needs to be dead after it. live are the registers live
+    # after the body.
+    live = set(live)
+    ret = []
+    for stmt in reversed(body):
+        if not isinstance(stmt, BodyNode):
+            if stmt._destindex in live:
+                live.discard(stmt._destindex)
+                live |= stmt.reads()
+            ret.append(stmt)
+            continue
+
+        _hoist_invariants(stmt.body, _loop_end_liveness(stmt, live))
+        hoisted = []
+        if isinstance(stmt, Loop):
+            i = 0
+            while i < len(stmt.body):
+                candidate = stmt.body[i]
+                others = stmt.body[:i] + stmt.body[i+1:]
+                written = set().union(*(other.writes() for other in others))
+                dest = candidate._destindex \
+                    if not isinstance(candidate, BodyNode) else None
+                if dest is None or _may_diverge(candidate) or \
+                        dest == stmt._varindex or \
+                        dest in live or dest in written or \
+                        candidate.reads() & (written | {dest}) or \
+                        any(dest in other.reads()
+                            for other in stmt.body[:i]):
+                    i += 1
+                    continue
+                hoisted.append(candidate)
+                del stmt.body[i]
+
+        ret.append(stmt)
+        live |= _liveness([stmt], live, False)
+        ret.extend(reversed(hoisted))
+        live = _liveness(hoisted, live, False)
+    body[:] = reversed(ret)
+
+optimizer_passes = ("constants", "copies", "invariants", "empty-loops",
+                    "dead-stores")
+
+# The passes recurse into the bodies, and the liveness analysis takes time
+# exponential in the nesting depth, so deeper programs are rejected.
+optimizer_max_depth = 20
+
+def _nesting_depth(body):
+    # without recursion, see BodyNode.to_string
+    depth = 0
+    stack = [(body, 1)]
+    while stack:
+        body, level = stack.pop()
+        for stmt in body:
+            if isinstance(stmt, BodyNode):
+                depth = max(depth, level)
+                stack.append((stmt.body, level + 1))
+    return depth
+
+def optimize(program, passes=optimizer_passes, rounds=8):
+    # Runs the given passes in the order of optimizer_passes, repeating
+    # them until the program does not change anymore (or for at most
+    # rounds times).
+    if _nesting_depth(program.body) > optimizer_max_depth:
+        raise ValueError(
+            "cannot optimize {} nested more than {} deep".format(
+                "procedure {}".format(program.name)
+                if isinstance(program, Procedure) else "programs",
+                optimizer_max_depth))
+    for procedure in getattr(program, "procedures", {}).values():
+        optimize(procedure, passes, rounds)
+    text = str(program)
+    for i in range(rounds):
+        if "constants" in passes:
+            _propagate_constants(program.body, {})
+        if "copies" in passes:
+            _propagate_copies(program.body, {})
+        if "invariants" in passes:
+            _hoist_invariants(program.body, {0})
+        if "empty-loops" in passes:
+            _remove_empty_loops(program.body)
+        if "dead-stores" in passes:
+            _liveness(program.body, {0}, True)
+        new_text = str(program)
+        if new_text == text:
+            break
+        text = new_text
+    return program
+
+def parse(s, whilep=False, add_assignment=False, procedures=False):
+    program = Program()
     node_types = [
         Loop, VarAssignment, ConstAssignment
     ]
@@ -264,9 +1182,15 @@ def parse(s, whilep=False, add_assignment=False):
         node_types.append(While)
     if add_assignment:
         node_types.insert(0, AddAssignment)
+    if procedures:
+        node_types[:0] = [
+            Procedure,
+            functools.partial(CallAssignment.parse,
+                              procedures=program.procedures),
+        ]
 
     node_stack = []
-    node = Program()
+    node = program
     lines = s.strip().split("\n")
     for line in lines:
         line = line.strip()
@@ -280,15 +1204,28 @@ def parse(s, whilep=False, add_assignment=False):
             continue
 
         if syntax_end.match(line):
+            if isinstance(node, Procedure):
+                # a procedure can only be called after its definition, so
+                # there is no recursion
+                program.procedures[node.name] = node
             node = node_stack.pop()
             continue
 
         for node_type in node_types:
-            new_node = node_type.parse(line)
+            new_node = getattr(node_type, "parse", node_type)(line)
             if new_node is None:
                 continue
 
-            node.body.append(new_node)
+            if isinstance(new_node, Procedure):
+                if node is not program:
+                    raise ValueError(
+                        "Procedures can only be defined at the top level:"
+                        " {}".format(line))
+                if new_node.name in program.procedures:
+                    raise ValueError(
+                        "Procedure defined twice: {}".format(line))
+            else:
+                node.body.append(new_node)
             if isinstance(new_node, BodyNode):
                 node_stack.append(node)
                 node = new_node
@@ -303,6 +1240,7 @@ if __name__ == "__main__":
     import argparse
     import os
     import sys
+    import time
 
     def posint(v):
         v = int(v)
@@ -326,6 +1264,53 @@ if __name__ == "__main__":
         help="Run the program, passing each argument as non-negative integer"
         " number to the variable slots starting from x_1 onwards. The result"
         " will be printed on STDOUT.")
+    parser.add_argument(
+        "-e", "--engine",
+        choices=("compiled", "bytecode", "tree"),
+        default="compiled",
+        help="How to run the program: compiled to Python closures, as"
+        " bytecode on a register machine, which has no limit on the nesting"
+        " depth, or by walking the parsed tree, which logs each statement"
+        " with -vvv (default: %(default)s)")
+    parser.add_argument(
+        "-O",
+        dest="optimizations",
+        action="append",
+        default=[],
+        choices=optimizer_passes + ("all",),
+        metavar="PASS",
+        help="Enable an optimizer pass: {} (or all of them). The"
+        " optimized program is what --dump prints and what runs. Programs"
+        " nested more than {} deep cannot be optimized.".format(
+            ", ".join(optimizer_passes), optimizer_max_depth))
+    parser.add_argument(
+        "--memo",
+        type=posint,
+        default=0,
+        metavar="SIZE",
+        help="Remember the results of up to SIZE argument tuples per"
+        " procedure (-fprocedures) with the compiled and bytecode engines")
+    parser.add_argument(
+        "--memo-stats",
+        action="store_true",
+        default=False,
+        help="Print the hits and misses of the procedure memos to STDERR")
+    parser.add_argument(
+        "--no-acceleration",
+        action="store_true",
+        default=False,
+        help="Run the compiled LOOPs step by step even where their effect"
+        " has a closed form")
+    parser.add_argument(
+        "--disassemble",
+        action="store_true",
+        default=False,
+        help="Dump the bytecode of the program to STDOUT")
+    parser.add_argument(
+        "-t", "--time",
+        action="store_true",
+        default=False,
+        help="Print the time the program took to run to STDERR")
     parser.add_argument(
         "-v",
         dest="verbosity",
@@ -343,7 +1328,22 @@ if __name__ == "__main__":
         dest="features",
         action="append",
         default=[],
-        help="Enable optional features")
+        help="Enable optional features: while, add-assignment, procedures")
+    parser.add_argument(
+        "--no-result-cache",
+        action="store_true",
+        default=False,
+        help="Neither look up nor store the result of --run in the result"
+        " cache below $XDG_CACHE_HOME/til-results, which otherwise returns"
+        " the result of an earlier run of the same program with the same"
+        " arguments without running it. Runs which are logged (-v), timed"
+        " or print memo statistics bypass the cache anyway.")
+    parser.add_argument(
+        "--refresh-result-cache",
+        action="store_true",
+        default=False,
+        help="Run the program even if its result is cached, and store the"
+        " new result.")
     parser.add_argument(
         "infile",
         nargs="?",
@@ -355,6 +1355,11 @@ if __name__ == "__main__":
     args = parser.parse_args()
     args.features = set(args.features)
 
+    # accelerated LOOPs easily produce results beyond the default limit on
+    # the digits of printed integers
+    if hasattr(sys, "set_int_max_str_digits"):
+        sys.set_int_max_str_digits(0)
+
     level = {
         0: logging.ERROR,
         1: logging.WARNING,
@@ -379,23 +1384,81 @@ if __name__ == "__main__":
     except KeyError:
         add_assignment = False
 
+    try:
+        args.features.remove("procedures")
+        procedures = True
+    except KeyError:
+        procedures = False
+
     if args.features:
         raise ValueError("Unsupported features: {}".format(
             ", ".join(args.features)))
 
+    # both are read when compiling, which --disassemble does already
+    accelerate = not args.no_acceleration
+    memo_size = args.memo
+
     try:
         program = parse(
             args.infile.read(),
             whilep=whilep,
-            add_assignment=add_assignment)
+            add_assignment=add_assignment,
+            procedures=procedures)
     finally:
         if args.infile is not sys.stdin:
             args.infile.close()
 
+    if "all" in args.optimizations:
+        args.optimizations = optimizer_passes
+    if args.optimizations:
+        try:
+            optimize(program, args.optimizations)
+        except ValueError as err:
+            parser.error(str(err))
+
     if args.dump:
         print(program)
 
+    if args.disassemble:
+        print(Bytecode(program))
+
     if args.run is not None:
-        vm = VM(*args.run)
-        program.run(vm)
-        print(vm.get(0))
+        result_cache = None
+        # a cached result would skip the statement log, the time and the
+        # statistics
+        if not (args.no_result_cache or args.verbosity or args.time or
+                args.memo_stats):
+            sys.path.insert(0, os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), os.pardir))
+            import resultcache
+            result_cache = resultcache.ResultCache()
+            # the program as printed is canonical, up to whitespace and
+            # comments
+            key = resultcache.key("loop", str(program), args.run)
+            if not args.refresh_result_cache:
+                result = result_cache.get(key)
+                if result is not None:
+                    print(result)
+                    sys.exit(0)
+
+        started = time.perf_counter()
+        if args.engine == "tree":
+            vm = VM(*args.run, size=program.highest_register() + 1)
+            program.run(vm)
+            result = vm.get(0)
+        elif args.engine == "bytecode":
+            result = Bytecode(program).run(*args.run)
+        else:
+            result = program.run_compiled(*args.run)
+        if args.time:
+            print("{:.3f}s".format(time.perf_counter() - started),
+                  file=sys.stderr)
+        if args.memo_stats:
+            for procedure in program.procedures.values():
+                print("{}: {} hits, {} misses, {} cached".format(
+                    procedure.name, *procedure.memo_stats()),
+                    file=sys.stderr)
+        if result_cache is not None:
+            result_cache.put(key, result)
+            result_cache.close()
+        print(result)